@@ -1,4 +1,5 @@
 import logging
+import os
 from datetime import datetime
 from typing import Optional
 
@@ -43,13 +44,24 @@ handler = NNRichHandler(
     show_time=True,
     omit_repeated_times=True,
 )
+dotenv.load_dotenv(dotenv_path=None, override=True)
+
+_log_level_name: str = os.environ.get("BEERS_LOG_LEVEL", "INFO").upper()
+# getLevelName maps the known level names to their number, anything else to a string
+_log_level = logging.getLevelName(_log_level_name)
+_log_level_known: bool = isinstance(_log_level, int)
+if not _log_level_known:
+    _log_level = logging.INFO
+
 FORMAT = "%(message)s"
 logging.basicConfig(
     format=FORMAT,
-    level=logging.DEBUG,
+    level=_log_level,
     datefmt="%Y-%m-%d %H:%M:%S",
     handlers=[handler],
 )
+if not _log_level_known:
+    logging.getLogger(__name__).warning("Unknown BEERS_LOG_LEVEL %r, falling back to INFO", _log_level_name)
 
 # Remove all handlers associated with the fastapi logger.
 # try:
@@ -60,8 +72,6 @@ logging.basicConfig(
 # except Exception:
 #     pass
 
-dotenv.load_dotenv(dotenv_path=None, override=True)
-
 try:
     from ._version import __version__ as __version__
 except ImportError:
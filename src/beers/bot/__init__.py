@@ -4,4 +4,5 @@ from beers.models import RequestUser
 
 
 def build_request_user(user: User) -> RequestUser:
-    return RequestUser(user_id=str(user.id), username=user.username, full_name=user.full_name)
+    # The fields come from a telegram User and are already well typed: skip the pydantic validation
+    return RequestUser.construct(user_id=str(user.id), username=user.username, full_name=user.full_name)
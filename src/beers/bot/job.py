@@ -1,25 +1,31 @@
-import json
+import asyncio
+import functools
+import html
 import logging
 import math
 import os.path
+import re
 import time
 from datetime import datetime
-from enum import auto
-from typing import Sequence
+from enum import IntEnum, auto
+from typing import Any, Mapping, Optional, Sequence, Tuple
 
-from telegram import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Update, User
-from telegram.ext import CallbackContext, CallbackQueryHandler, ConversationHandler, Filters, MessageHandler
+import orjson
+from cachetools import TTLCache
+from telegram import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message, Update, User
+from telegram.constants import ParseMode
+from telegram.ext import ContextTypes, ConversationHandler
+from telegram.ext.filters import MessageFilter
 
 from beers.bot import build_request_user
 from beers.bot.telegram_bot import _CB_JOB_LIST, _CB_JOB_NEW, BeersBot
 from beers.manager.api import MESSAGE_TEMPLATES, ManagerAnswer, ReturnCodes
 from beers.models import JobRequestModel
-from beers.utils import StrEnum
 
 pylogger = logging.getLogger(__name__)
 
 
-class JobStates(StrEnum):
+class JobStates(IntEnum):
     WORKER = auto()
     GPU = auto()
     IMAGE = auto()
@@ -35,6 +41,26 @@ class JobStates(StrEnum):
 _PREDEFINED_IMAGES: Sequence[str] = ["grokai/beers_job:0.0.1"]
 _PREDEFINED_MOUNTS: Sequence[str] = ["/home/beers/data"]
 
+# Abandoned wizards are ended (and their user data released) after this many seconds of inactivity
+_CONVERSATION_TIMEOUT: int = 600
+# user_data entries only meaningful while a job wizard is in progress
+_WIZARD_KEYS: Sequence[str] = ("resources", "gpus_flat", "gpus_formatted", "job", "last_msg_id")
+
+_TEXT_MOUNT_SOURCE: str = "Please now select the NFS server to mount your data <b>from</b>."
+_TEXT_MOUNT_TARGET: str = (
+    "Please now type the mount location for the user-specific volume (persistent data).\n"
+    "The path has to be absolute as the default one.\n"
+    "Please keep in mind that <b>only the data in the volume</b> will be saved across jobs."
+)
+_TEXT_DURATION: str = (
+    "Please now type the expected duration of this job (in hours).\n\n"
+    "<b>It won't be automatically deleted </b>when it expires, don't worry."
+    " You'll just get notified and asked to adjust the <u>expected</u> duration."
+)
+
+_MAX_DURATION_HOURS: int = 24 * 365
+_MAX_DURATION_DIGITS: int = len(str(_MAX_DURATION_HOURS))
+
 _CB_IMAGE_PREFIX: str = "cb_image#"
 _CB_FINAL: str = "cb_final#"
 _CB_MOUNT_SOURCE: str = "cb_mount_source#"
@@ -45,510 +71,604 @@ _CB_JOB_INFO: str = "cb_job_info#"
 _CB_JOB_REMOVE: str = "cb_job_rm#"
 _CB_JOB_LIST_RELOAD: str = "cb_job_list_reload#"
 
+# Users known to have an SSH key set. Only positive answers are cached: a key, once set, can only be replaced
+_SSH_KEY_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=3600)
+# Short-lived snapshot of the resources available to each user, cleared whenever a job is scheduled
+_RESOURCES_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=30)
+
+_PREDEFINED_IMAGE_MARKUP: InlineKeyboardMarkup = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text=image_name, callback_data=f"{_CB_IMAGE_PREFIX}{i}")
+            for i, image_name in enumerate(_PREDEFINED_IMAGES)
+        ]
+    ]
+)
+_PREDEFINED_MOUNT_MARKUP: InlineKeyboardMarkup = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text=mount_path, callback_data=f"{_CB_MOUNT_TARGET}{i}")
+            for i, mount_path in enumerate(_PREDEFINED_MOUNTS)
+        ]
+    ]
+)
+_CONFIRM_RESTART_MARKUP: InlineKeyboardMarkup = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text=action.capitalize(), callback_data=f"{_CB_FINAL}{action}")
+            for action in ("confirm", "restart")
+        ]
+    ]
+)
+
+# Patterns are compiled once here and handed over to PTB as they are.
+# The payload of a callback is captured by the pattern and read back from context.match in the handler
+_CB_JOB_NEW_RE: re.Pattern = re.compile(f"^{re.escape(_CB_JOB_NEW)}")
+_CB_JOB_LIST_RE: re.Pattern = re.compile(f"^{re.escape(_CB_JOB_LIST)}")
+_CB_IMAGE_RE: re.Pattern = re.compile(f"^{re.escape(_CB_IMAGE_PREFIX)}(\\d+)$")
+_CB_FINAL_RE: re.Pattern = re.compile(f"^{re.escape(_CB_FINAL)}(confirm|restart)$")
+_CB_MOUNT_SOURCE_RE: re.Pattern = re.compile(f"^{re.escape(_CB_MOUNT_SOURCE)}(.+)$")
+_CB_MOUNT_TARGET_RE: re.Pattern = re.compile(f"^{re.escape(_CB_MOUNT_TARGET)}(\\d+)$")
+_CB_JOB_INFO_RE: re.Pattern = re.compile(f"^{re.escape(_CB_JOB_INFO)}(\\d+)$")
+_CB_JOB_REMOVE_RE: re.Pattern = re.compile(f"^{re.escape(_CB_JOB_REMOVE)}(\\d+)$")
+_CB_JOB_LIST_RELOAD_RE: re.Pattern = re.compile(f"^{re.escape(_CB_JOB_LIST_RELOAD)}")
+
+
+class _DigitFilter(MessageFilter):
+    """Let through only the messages made of decimal digits, i.e. the ones int() can always convert."""
+
+    def filter(self, message: Message) -> bool:
+        return message.text is not None and message.text.isdecimal()
+
+
+_DIGIT_FILTER: _DigitFilter = _DigitFilter()
+
+
+@functools.lru_cache(maxsize=128)
+def _nfs_servers_markup(hostnames: Tuple[str, ...]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                *(
+                    InlineKeyboardButton(text=hostname, callback_data=f"{_CB_MOUNT_SOURCE}{hostname}")
+                    for hostname in hostnames
+                ),
+                InlineKeyboardButton(text="None", callback_data=f"{_CB_MOUNT_SOURCE}None"),
+            ]
+        ]
+    )
+
+
+def _nfs_servers(resources: Mapping[str, Any]) -> InlineKeyboardMarkup:
+    return _nfs_servers_markup(
+        tuple(
+            worker["hostname"] for worker in resources["workers"].values() if worker.get("local_nfs_root") is not None
+        )
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _job_list_markup(n_jobs: int) -> InlineKeyboardMarkup:
+    # The buttons only depend on how many jobs are listed, reloading an unchanged list reuses them
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                *(InlineKeyboardButton(text=f"Job {i}", callback_data=f"{_CB_JOB_INFO}{i}") for i in range(n_jobs)),
+                InlineKeyboardButton(text="Jobs Reload ♻️", callback_data=_CB_JOB_LIST_RELOAD),
+            ]
+        ]
+    )
+
+
+def _render_service(i: int, service: Mapping[str, Any], now: float) -> str:
+    job = service["job"]
+    hostname: str = job["worker_hostname"]
+    gpu: str = job["gpu"]["name"]
+    # Docker tasks may be missing or partially filled in: prefer a running one, then the first one, then nothing
+    statuses: Sequence[Mapping[str, Any]] = [task.get("Status") or {} for task in service.get("docker_tasks") or ()]
+    status: Mapping[str, Any] = next(
+        (task_status for task_status in statuses if task_status.get("State") == "running"),
+        statuses[0] if statuses else {},
+    )
+
+    expected_end: float = datetime.fromisoformat(job["expected_end_time"]).timestamp()
+    remaining_hours: int = math.ceil(max(0.0, expected_end - now) / 3600)
+
+    state: str = status.get("State", "unknown")
+    rendered: str = f"""
+                        <b>{i}]</b> Worker: <b>{hostname}</b>
+                            GPU(s): <b>{gpu}</b>
+                            Remaining Hours: <b>~{remaining_hours}</b>
+                            Job State: <b>{state}</b>
+                        """
+    if state == "running":
+        port: str = ((status.get("PortStatus") or {}).get("Ports") or [{}])[0].get("PublishedPort", "?")
+        ip: str = job["gpu"]["worker"]["ip"]
+
+        rendered += f"    Access with: <code>ssh root@{ip} -p {port}</code>\n"
+
+    return rendered
+
+
+def _clear_wizard(context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Once the wizard ends, none of its entries is needed anymore (nor worth persisting)
+    for key in _WIZARD_KEYS:
+        context.user_data.pop(key, None)
+
 
 class JobHandler:
     def __init__(self, bot: BeersBot):
         self.bot = bot
 
-    def job_new(self, update: Update, context: CallbackContext):
+    async def job_new(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        query.answer()
+        await query.answer()
         request_user: User = update.effective_user
 
-        if not self.bot.manager_service.check_ssh_key(request_user=build_request_user(request_user)):
-            context.bot.send_message(
-                chat_id=update.effective_chat.id,
+        has_ssh_key, resources = await self._bootstrap(request_user=request_user)
+
+        if not has_ssh_key:
+            await update.effective_message.reply_text(
                 text=MESSAGE_TEMPLATES[ReturnCodes.KEY_MISSING_ERROR],
-                parse_mode="HTML",
+                parse_mode=ParseMode.HTML,
             )
             return ConversationHandler.END
 
-        resources_answer: ManagerAnswer = self.bot.manager_service.list_resources(
-            request_user=build_request_user(request_user)
-        )
-        if resources_answer.code == ReturnCodes.RESOURCES:
-            context.user_data["resources"] = resources_answer.data
+        if resources is not None:
+            context.user_data["resources"] = resources
+            # Flatten and format the GPUs once per conversation, they are reused on every (invalid) selection
+            gpus_flat: Sequence[dict] = [gpu for gpu_list in resources["gpus"].values() for gpu in gpu_list]
+            context.user_data["gpus_flat"] = gpus_flat
+            context.user_data["gpus_formatted"] = self.format_gpus(gpus_flat=gpus_flat)
             context.user_data["job"] = {}
         else:
-            context.bot.send_message(
-                chat_id=update.effective_chat.id,
+            await update.effective_message.reply_text(
                 text="Error retrieving available resources. Can't dispatch jobs!",
-                parse_mode="HTML",
+                parse_mode=ParseMode.HTML,
             )
             return ConversationHandler.END
 
-        resources = context.user_data["resources"]
+        return await self._prompt_gpu(update=update, context=context)
 
-        context.bot.send_message(
-            chat_id=update.effective_chat.id,
+    async def _bootstrap(self, request_user: User) -> Tuple[bool, Optional[dict]]:
+        # Once the SSH key is known to be set only the resources can be missing, otherwise a single manager request
+        # returns both
+        if _SSH_KEY_CACHE.get(request_user.id, False):
+            return True, await self._list_resources(request_user=request_user)
+
+        answer: ManagerAnswer = await asyncio.to_thread(
+            self.bot.manager_service.bootstrap, request_user=build_request_user(request_user)
+        )
+        if answer.code != ReturnCodes.BOOTSTRAP:
+            return False, None
+
+        has_ssh_key: bool = answer.data["is_set"]
+        if has_ssh_key:
+            _SSH_KEY_CACHE[request_user.id] = True
+        resources: Optional[dict] = answer.data["resources"]
+        if resources is not None:
+            _RESOURCES_CACHE[request_user.id] = resources
+        return has_ssh_key, resources
+
+    async def _list_resources(self, request_user: User) -> Optional[dict]:
+        resources: Optional[dict] = _RESOURCES_CACHE.get(request_user.id)
+        if resources is None:
+            resources_answer: ManagerAnswer = await asyncio.to_thread(
+                self.bot.manager_service.list_resources, request_user=build_request_user(request_user)
+            )
+            if resources_answer.code == ReturnCodes.RESOURCES:
+                resources = _RESOURCES_CACHE[request_user.id] = resources_answer.data
+        return resources
+
+    async def _prompt_gpu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await update.effective_message.reply_text(
             text=f"Please select one of these GPUs (by typing its index, e.g. 42):"
-            f"\n\n{self.format_gpus(resources=resources)}",
-            parse_mode="HTML",
+            f"\n\n{context.user_data['gpus_formatted']}",
+            parse_mode=ParseMode.HTML,
         )
 
         return JobStates.GPU
 
-    def format_gpus(self, resources):
-        gpus = [
-            (gpu["name"], gpu.get("owner", None), f'{gpu["total_memory"]}MB', worker)
-            for worker, gpu_list in resources["gpus"].items()
-            for gpu in gpu_list
-        ]
-        gpus_string: str = "\n\n".join(
-            f"<b>Index: {i}</b> | <b>Name</b>: {name} | <b>Memory</b>: {memory} | <b>Worker</b>: {worker} | <b>Owner</b>: {owner}"
-            for i, (name, owner, memory, worker) in enumerate(gpus)
+    @staticmethod
+    def format_gpus(gpus_flat: Sequence[dict]) -> str:
+        return "\n\n".join(
+            f"<b>Index: {i}</b> | <b>Name</b>: {gpu['name']} | <b>Memory</b>: {gpu['total_memory']}MB | "
+            f"<b>Worker</b>: {gpu['worker']} | <b>Owner</b>: {gpu.get('owner')}"
+            for i, gpu in enumerate(gpus_flat)
         )
 
-        return gpus_string
+    @staticmethod
+    def format_job(job: Mapping[str, Any]) -> str:
+        gpu: Mapping[str, Any] = job["gpus"][0]
+        mounts: str = " | ".join(
+            f"{mount['source_ip']}:{mount['source_root']} → {html.escape(mount['target'])}" for mount in job["mounts"]
+        )
+        mount: str = mounts or "None"
+        return "\n".join(
+            f"<b>{field}</b>: {value}"
+            for field, value in (
+                ("Image", html.escape(job["image"])),
+                ("GPU", f"{gpu['name']} ({gpu['total_memory']}MB)"),
+                ("Worker", job["worker_hostname"]),
+                ("Mount", mount),
+                ("Duration (hours)", job["duration"]),
+            )
+        )
 
-    def gpu(self, update: Update, context: CallbackContext):
-        gpu_index: str = update.message.text.strip()
+    async def gpu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # The state filter only lets digit strings through, so the conversion cannot fail
+        gpu_index: int = int(update.message.text)
+        gpus_flat: Sequence[dict] = context.user_data["gpus_flat"]
 
-        resources = context.user_data["resources"]
-        try:
-            gpu_index: int = int(gpu_index)
-            gpu: dict = list(gpu for gpu_list in resources["gpus"].values() for gpu in gpu_list)[gpu_index]
-            # TODO: handle multiple gpus
-            context.user_data["job"]["gpus"] = [gpu]
-        except Exception:
-            context.bot.send_message(
-                chat_id=update.effective_chat.id,
+        if gpu_index >= len(gpus_flat):
+            await update.effective_message.reply_text(
                 text=f"<code>{gpu_index}</code> is not a valid GPU index.\n\n"
                 f"Please select one of these GPUs (by typing its index, e.g. 42):\n\n"
-                f"{self.format_gpus(resources=resources)}",
-                parse_mode="HTML",
+                f"{context.user_data['gpus_formatted']}",
+                parse_mode=ParseMode.HTML,
             )
             return JobStates.GPU
 
-        predefined_images = [
-            InlineKeyboardButton(text=image_name, callback_data=f"{_CB_IMAGE_PREFIX}{i}")
-            for i, image_name in enumerate(_PREDEFINED_IMAGES)
-        ]
-        context.bot.send_message(
-            chat_id=update.effective_chat.id,
+        # TODO: handle multiple gpus, checking here that they all belong to the same worker
+        gpu: dict = gpus_flat[gpu_index]
+        context.user_data["job"]["gpus"] = [gpu]
+        context.user_data["job"]["worker_hostname"] = gpu["worker"]
+
+        await update.effective_message.reply_text(
             text="Please select a Docker image by typing its name (e.g. <code>grokai/beer_job:0.0.1</code>)"
             " or pressing the predefined buttons.\n\n"
             "N.B. The image must be available on Docker Hub (or locally on the machine). "
             "If you don't know what this means, just use the default one :] ",
-            parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[predefined_images]),
+            parse_mode=ParseMode.HTML,
+            reply_markup=_PREDEFINED_IMAGE_MARKUP,
         )
 
         return JobStates.IMAGE
 
-    def image_cb(self, update: Update, context: CallbackContext):
+    async def image_cb(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        if not query.data.startswith(_CB_IMAGE_PREFIX):
-            query.answer("Something went wrong. Type the image name instead of using buttons.")
+        image_index: int = int(context.match.group(1))
+        if image_index >= len(_PREDEFINED_IMAGES):
+            await query.answer("Something went wrong. Type the image name instead of using buttons.")
             return JobStates.IMAGE
 
-        try:
-            image_index = int(query.data[len(_CB_IMAGE_PREFIX) :])
-            # TODO: image validation/availability check
-            image: str = _PREDEFINED_IMAGES[image_index]
-            context.user_data["job"]["image"] = image
-        except Exception:
-            query.answer("Something went wrong. Type the image name instead of using buttons.")
-            return JobStates.IMAGE
-
-        query.answer(f"Image selected: {image}")
-
-        nfs_servers = [
-            InlineKeyboardButton(text=worker["hostname"], callback_data=f"{_CB_MOUNT_SOURCE}{worker['hostname']}")
-            for worker in context.user_data["resources"]["workers"].values()
-            if worker.get("local_nfs_root") is not None
-        ]
-        nfs_servers.append(InlineKeyboardButton(text="None", callback_data=f"{_CB_MOUNT_SOURCE}None"))
+        # TODO: image validation/availability check
+        image: str = _PREDEFINED_IMAGES[image_index]
+        context.user_data["job"]["image"] = image
 
-        context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="Please now select the NFS server to mount your data <b>from</b>.",
-            parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[nfs_servers]),
-        )
+        await query.answer(f"Image selected: {image}")
 
-        context.user_data["job"]["mounts"] = [{}]
-        return JobStates.MOUNT_SOURCE
+        return await self._prompt_mount_source(update=update, context=context)
 
-    def image(self, update: Update, context: CallbackContext):
+    async def image(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         # TODO: image validation/availability check
         context.user_data["job"]["image"] = update.message.text.strip()
 
-        nfs_servers = [
-            InlineKeyboardButton(text=worker["hostname"], callback_data=f"{_CB_MOUNT_SOURCE}{worker['hostname']}")
-            for worker in context.user_data["resources"]["workers"].values()
-            if worker.get("local_nfs_root") is not None
-        ]
-        nfs_servers.append(InlineKeyboardButton(text="None", callback_data=f"{_CB_MOUNT_SOURCE}None"))
+        return await self._prompt_mount_source(update=update, context=context)
 
-        context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="Please now select the NFS server to mount your data <b>from</b>.",
-            parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[nfs_servers]),
+    async def _prompt_mount_source(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        context.user_data["job"]["mounts"] = [{}]
+        await self._send_prompt(
+            update=update,
+            context=context,
+            text=_TEXT_MOUNT_SOURCE,
+            reply_markup=_nfs_servers(resources=context.user_data["resources"]),
         )
 
-        context.user_data["job"]["mounts"] = [{}]
         return JobStates.MOUNT_SOURCE
 
-    def mount_source_cb(self, update: Update, context: CallbackContext):
+    async def mount_source_cb(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        if not query.data.startswith(_CB_MOUNT_SOURCE):
-            query.answer("Something went wrong. Please try again.")
-            return JobStates.MOUNT_SOURCE
-
-        try:
-            worker_name: str = query.data[len(_CB_MOUNT_SOURCE) :]
-            if worker_name != "None":
-                mount = context.user_data["job"]["mounts"][0]
-                worker = context.user_data["resources"]["workers"][worker_name]
-                mount["source_ip"] = worker["ip"]
-                mount["source_root"] = worker["local_nfs_root"]
-            else:
-                context.user_data["job"]["mounts"] = []
-        except Exception:
-            query.answer("Something went wrong. Please try again.")
-            return JobStates.MOUNT_SOURCE
-
-        query.answer(f"NFS mount source selected: {worker_name}")
-
+        worker_name: str = context.match.group(1)
         if worker_name != "None":
-            target_mounts = [
-                InlineKeyboardButton(text=mount_path, callback_data=f"{_CB_MOUNT_TARGET}{i}")
-                for i, mount_path in enumerate(_PREDEFINED_MOUNTS)
-            ]
+            worker: Optional[dict] = context.user_data["resources"]["workers"].get(worker_name)
+            if worker is None:
+                await query.answer("Something went wrong. Please try again.")
+                return JobStates.MOUNT_SOURCE
+
+            mount: dict = context.user_data["job"]["mounts"][0]
+            mount["source_ip"] = worker["ip"]
+            mount["source_root"] = worker["local_nfs_root"]
+        else:
+            context.user_data["job"]["mounts"] = []
 
-            context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="Please now type the mount location for the user-specific volume (persistent data).\n"
-                "The path has to be absolute as the default one.\n"
-                "Please keep in mind that <b>only the data in the volume</b> will be saved across jobs.",
-                parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[target_mounts]),
+        await query.answer(f"NFS mount source selected: {worker_name}")
+
+        if worker_name != "None":
+            await self._send_prompt(
+                update=update, context=context, text=_TEXT_MOUNT_TARGET, reply_markup=_PREDEFINED_MOUNT_MARKUP
             )
 
             return JobStates.MOUNT_TARGET
         else:
-            context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="Please now type the expected duration of this job (in hours).\n\n"
-                "<b>It won't be automatically deleted </b>when it expires, don't worry."
-                " You'll just get notified and asked to adjust the <u>expected</u> duration.",
-                parse_mode="HTML",
-            )
+            return await self._prompt_duration(update=update, context=context)
 
-            return JobStates.DURATION
-
-    def mount_target_cb(self, update: Update, context: CallbackContext):
-        pylogger.error(context.user_data)
+    async def mount_target_cb(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if pylogger.isEnabledFor(logging.DEBUG):
+            pylogger.debug(
+                "mount_target_cb user_data: %s",
+                orjson.dumps(context.user_data, option=orjson.OPT_NON_STR_KEYS).decode(),
+            )
 
         query = update.callback_query
-        if not query.data.startswith(_CB_MOUNT_TARGET):
-            query.answer("Something went wrong. Please try again or restart the procedure.")
-            return JobStates.MOUNT_TARGET
-
-        try:
-            pylogger.info(context.user_data)
-            mount_index = int(query.data[len(_CB_MOUNT_TARGET) :])
-            mount: str = _PREDEFINED_MOUNTS[mount_index]
-            context.user_data["job"]["mounts"][0]["target"] = mount
-        except Exception:
-            query.answer("Something went wrong. Type the mount path instead of using buttons.")
+        mount_index: int = int(context.match.group(1))
+        if mount_index >= len(_PREDEFINED_MOUNTS):
+            await query.answer("Something went wrong. Type the mount path instead of using buttons.")
             return JobStates.MOUNT_TARGET
 
-        query.answer(f"Mount selected: {mount}")
+        mount: str = _PREDEFINED_MOUNTS[mount_index]
+        context.user_data["job"]["mounts"][0]["target"] = mount
 
-        context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="Please now type the expected duration of this job.\n\n"
-            "<b>It won't be automatically deleted </b>when it expires, don't worry."
-            " You'll just get notified and asked to adjust the <u>expected</u> duration.",
-            parse_mode="HTML",
-        )
+        await query.answer(f"Mount selected: {mount}")
 
-        return JobStates.DURATION
+        return await self._prompt_duration(update=update, context=context)
 
-    def mount_target(self, update: Update, context: CallbackContext):
+    async def mount_target(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         mount_path: str = update.message.text.strip()
 
         if not os.path.isabs(mount_path):
-            context.bot.send_message(
-                chat_id=update.effective_chat.id,
+            await update.effective_message.reply_text(
                 text="Please now type an <b>absolute path</b>. "
                 "Keeping in mind that the default home is <code>/home/beers</code>",
-                parse_mode="HTML",
+                parse_mode=ParseMode.HTML,
             )
             return JobStates.MOUNT_TARGET
 
         context.user_data["job"]["mounts"][0]["target"] = mount_path
 
-        context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text="Please now type the expected duration of this job (in hours).\n"
-            "<b>It won't be automatically deleted </b>when it expires, don't worry."
-            "You'll just get notified and asked to adjust the expected duration.",
-            parse_mode="HTML",
-        )
+        return await self._prompt_duration(update=update, context=context)
+
+    async def _prompt_duration(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await self._send_prompt(update=update, context=context, text=_TEXT_DURATION)
 
         return JobStates.DURATION
 
-    def duration(self, update: Update, context: CallbackContext):
-        try:
-            duration: int = int(update.message.text.strip())
-        except Exception:
-            context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="Error parsing the expected duration. It must be an integer, representing the number of hours."
-                "\n\nPlease try again.",
-                parse_mode="HTML",
+    async def _send_prompt(
+        self,
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ):
+        if (query := update.callback_query) is not None:
+            # Coming from a button: replace its message instead of sending a new one
+            await query.edit_message_text(text=text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+            context.user_data["last_msg_id"] = query.message.message_id
+        else:
+            message = await update.effective_message.reply_text(
+                text=text, parse_mode=ParseMode.HTML, reply_markup=reply_markup
+            )
+            context.user_data["last_msg_id"] = message.message_id
+
+    async def duration(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # The state filter only lets digit strings through: bound their length before converting them
+        duration_str: str = update.message.text
+        duration: int = int(duration_str) if len(duration_str) <= _MAX_DURATION_DIGITS else 0
+
+        if not 0 < duration <= _MAX_DURATION_HOURS:
+            await update.effective_message.reply_text(
+                text=f"Invalid expected duration. It must be an integer between 1 and {_MAX_DURATION_HOURS}, "
+                "representing the number of hours.\n\nPlease try again.",
+                parse_mode=ParseMode.HTML,
             )
             return JobStates.DURATION
 
-        context.user_data["job"]["duration"] = duration
-
-        actions = [
-            InlineKeyboardButton(text=action.capitalize(), callback_data=f"{_CB_FINAL}{action}")
-            for action in ("confirm", "restart")
-        ]
+        job: dict = context.user_data["job"]
+        job["duration"] = duration
 
-        context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=f"As last step, please confirm the job specifics or start again "
-            f"(yes, I'll implement a proper edit soon enough):\n\n{json.dumps(context.user_data['job'], indent=4)}",
-            parse_mode="HTML",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[actions]),
-        )
+        text: str = f"As last step, please confirm the job specifics or start again:\n\n{self.format_job(job=job)}"
+        last_msg_id: Optional[int] = context.user_data.get("last_msg_id")
+        if last_msg_id is None:
+            await update.effective_message.reply_text(
+                text=text, parse_mode=ParseMode.HTML, reply_markup=_CONFIRM_RESTART_MARKUP
+            )
+        else:
+            # Turn the duration prompt into the job summary, instead of sending yet another message
+            await context.bot.edit_message_text(
+                chat_id=update.effective_chat.id,
+                message_id=last_msg_id,
+                text=text,
+                parse_mode=ParseMode.HTML,
+                reply_markup=_CONFIRM_RESTART_MARKUP,
+            )
 
         return JobStates.CONFIRM
 
-    def confirm(self, update: Update, context: CallbackContext):
+    async def confirm(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         request_user: User = update.effective_user
 
         query = update.callback_query
-        if not query.data.startswith(_CB_FINAL):
-            query.answer("Something went wrong, very wrong :[")
-            return JobStates.CONFIRM
-
-        cb_op = query.data[len(_CB_FINAL) :]
+        cb_op: str = context.match.group(1)
         if cb_op == "confirm":
             job_details = context.user_data["job"]
 
-            workers = set(gpu["worker"] for gpu in job_details["gpus"])
-            assert len(workers) == 1  # TODO: this should be checked earlier on, when adding multiple GPUs
-
-            job = JobRequestModel(
-                user_id=request_user.id,
-                image=job_details["image"],
-                worker_hostname=workers.pop(),
-                gpus=job_details["gpus"],
-                expected_duration=job_details["duration"],
-                mounts=job_details["mounts"],
+            # Acknowledge the button press before the (possibly slow) dispatch on the manager side
+            await query.answer("Submitting your job...")
+
+            job = JobRequestModel.parse_obj(
+                {
+                    "user_id": request_user.id,
+                    "image": job_details["image"],
+                    "worker_hostname": job_details["worker_hostname"],
+                    "gpus": job_details["gpus"],
+                    "expected_duration": job_details["duration"],
+                    "mounts": job_details["mounts"],
+                }
             )
 
-            resources_answer: ManagerAnswer = self.bot.manager_service.job(
-                request_user=build_request_user(request_user), job=job
+            resources_answer: ManagerAnswer = await asyncio.to_thread(
+                self.bot.manager_service.job, request_user=build_request_user(request_user), job=job
             )
-            context.bot.send_message(
-                chat_id=update.effective_chat.id,
+            if not resources_answer.code.is_error:
+                # The scheduled job consumed some GPUs: every cached snapshot is now stale
+                _RESOURCES_CACHE.clear()
+            # Replace the job summary and its buttons with the outcome
+            await query.edit_message_text(
                 text=resources_answer.message
                 if resources_answer.code.is_error
-                else "Job scheduled! Use the /job command to check its status in the job list",
-                parse_mode="HTML",
+                else "Job scheduled! You'll get updates about your job soon enough (hopefully)!\n"
+                "Use the /job command to check its status in the job list",
+                parse_mode=ParseMode.HTML,
             )
 
-            context.user_data["job"] = {}
-            context.user_data["resources"] = {}
-            query.answer("Done! You'll get updates about your job soon enough (hopefully)!")
+            _clear_wizard(context=context)
 
             return ConversationHandler.END
         elif cb_op == "restart":
-            query.answer("Great! Let's fill out everything again!")
+            context.user_data["job"] = {}
+            if context.user_data.get("gpus_flat"):
+                # Resources are still cached from this conversation: skip the manager round-trip
+                await query.answer("Great! Let's fill out everything again!")
+                return await self._prompt_gpu(update=update, context=context)
 
-            return self.job_new(update=update, context=context)
+            # job_new answers the callback query itself, before querying the manager
+            return await self.job_new(update=update, context=context)
         else:
-            query.answer("Something went wrong, very wrong :[")
+            await query.answer("Something went wrong, very wrong :[")
             return JobStates.CONFIRM
 
-    def fallback(self, update: Update, context: CallbackContext):
-        context.bot.send_message(
-            chat_id=update.effective_chat.id,
+    async def fallback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await update.effective_message.reply_text(
             text="Error handling this message. Be sure to be following the request of the previous message.",
-            parse_mode="HTML",
+            parse_mode=ParseMode.HTML,
         )
 
-    def job_list(self, update: Update, context: CallbackContext):
-        print("job_list")
+    async def timeout(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        _clear_wizard(context=context)
+
+    async def job_list(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        query.answer()
+        await query.answer()
 
         request_user: User = update.effective_user
+        pylogger.debug("job_list invoked by user %s", request_user.id)
 
-        text, reply_markup = self.build_job_list(request_user=request_user, context=context)
+        text, reply_markup = await self.build_job_list(request_user=request_user, context=context)
 
-        context.bot.send_message(
-            chat_id=update.effective_chat.id,
+        await update.effective_message.reply_text(
             text=text,
-            parse_mode="HTML",
+            parse_mode=ParseMode.HTML,
             reply_markup=reply_markup,
         )
 
         return JobStates.INFO
 
-    def build_job_list(self, request_user: User, context: CallbackContext):
-        user_jobs = self.bot.manager_service.job_list(request_user=build_request_user(request_user))
+    async def build_job_list(self, request_user: User, context: ContextTypes.DEFAULT_TYPE):
+        user_jobs = await asyncio.to_thread(
+            self.bot.manager_service.job_list, request_user=build_request_user(request_user)
+        )
         services = user_jobs.data["services"]
         context.user_data["jobs"] = services
 
         now: float = time.time()
-        now: datetime = datetime.fromtimestamp(now)
 
         if len(services) > 0:
-            message: str = "These are the running jobs (Docker containers) associated with your account:\n"
-            for i, service in enumerate(services):
-                job = service["job"]
-                hostname: str = job["worker_hostname"]
-                gpu: str = job["gpu"]["name"]
-                status: Sequence = [
-                    container["Status"]
-                    for container in service["docker_tasks"]
-                    if container.get("Status", {"State": {}}).get("State", None) == "running"
-                ]
-                if len(status) == 0:
-                    status = service["docker_tasks"][0]
-                else:
-                    status = status[0]
-
-                expected_end: datetime = datetime.fromisoformat(job["expected_end_time"])
-                remaining_hours = math.ceil((expected_end - now).seconds / 60 / 60)
-
-                state: str = status["State"]
-                message += f"""
-                        <b>{i}]</b> Worker: <b>{hostname}</b>
-                            GPU(s): <b>{gpu}</b>
-                            Remaining Hours: <b>~{remaining_hours}</b>
-                            Job State: <b>{state}</b>
-                        """
-                if state == "running":
-                    port: str = status["PortStatus"]["Ports"][0]["PublishedPort"]
-                    ip: str = job["gpu"]["worker"]["ip"]
-
-                    message += f"    Access with: <code>ssh root@{ip} -p {port}</code>\n"
-            message += "\n\nClick on one of the following buttons to access their own info."
+            message: str = "".join(
+                (
+                    "These are the running jobs (Docker containers) associated with your account:\n",
+                    *(_render_service(i=i, service=service, now=now) for i, service in enumerate(services)),
+                    "\n\nClick on one of the following buttons to access their own info.",
+                )
+            )
         else:
             message = "There is no pending job for your account."
 
-        buttons = [
-            InlineKeyboardButton(text=f"Job {i}", callback_data=f"{_CB_JOB_INFO}{i}") for i, job in enumerate(services)
-        ]
-        buttons.append(InlineKeyboardButton(text="Jobs Reload ♻️", callback_data=f"{_CB_JOB_LIST_RELOAD}"))
-
-        return message, InlineKeyboardMarkup([buttons])
+        return message, _job_list_markup(n_jobs=len(services))
 
-    def job_reload(self, update: Update, context: CallbackContext):
-        print("job-reload")
+    async def job_reload(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query: CallbackQuery = update.callback_query
-        query.answer()
+        await query.answer()
 
         request_user: User = update.effective_user
+        pylogger.debug("job_reload invoked by user %s", request_user.id)
 
-        text, reply_markup = self.build_job_list(request_user=request_user, context=context)
+        text, reply_markup = await self.build_job_list(request_user=request_user, context=context)
 
-        context.bot.edit_message_text(
+        await context.bot.edit_message_text(
             chat_id=update.effective_chat.id,
             message_id=query.message.message_id,
             text=text,
-            parse_mode="HTML",
+            parse_mode=ParseMode.HTML,
             reply_markup=reply_markup,
         )
 
         return JobStates.INFO
 
-    def job_info(self, update: Update, context: CallbackContext):
+    async def job_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        query.answer()
-
-        try:
-            user_jobs = context.user_data["jobs"]
-
-            if not query.data.startswith(_CB_JOB_INFO):
-                query.answer("Something went wrong. Please try again.")
-                return
-
-            job_index: int = int(query.data[len(_CB_JOB_INFO) :])
-            job: dict = user_jobs[job_index]
-            job
-        except Exception:
-            query.answer("Something went wrong. Please try again.")
+        job_index: int = int(context.match.group(1))
+        user_jobs: Sequence[dict] = context.user_data.get("jobs", ())
+        if job_index >= len(user_jobs):
+            await query.answer("Something went wrong. Please try again.")
             return
 
-        context.bot.editMessageText(
-            message_id=update.effective_message.message_id,
-            chat_id=update.effective_chat.id,
-            text="Job info...",
-            parse_mode="HTML",
+        job: dict = user_jobs[job_index]
+        await query.answer()
+
+        # Show the selected job in place of the list, its details were already fetched by build_job_list
+        await query.edit_message_text(
+            text=_render_service(i=job_index, service=job, now=time.time()),
+            parse_mode=ParseMode.HTML,
             reply_markup=InlineKeyboardMarkup(
                 [[InlineKeyboardButton(text="Remove Job", callback_data=f"{_CB_JOB_REMOVE}{job_index}")]]
             ),
         )
         return JobStates.REMOVE
 
-    def job_rm(self, update: Update, context: CallbackContext):
+    async def job_rm(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
-        query.answer()
-
         request_user: User = update.effective_user
 
-        try:
-            user_jobs = context.user_data["jobs"]
-
-            if not query.data.startswith(_CB_JOB_REMOVE):
-                query.answer("Something went wrong. Please try again.")
-                return
-
-            job_index: int = int(query.data[len(_CB_JOB_REMOVE) :])
-            job: dict = user_jobs[job_index]
-        except Exception:
-            query.answer("Something went wrong. Please try again.")
+        job_index: int = int(context.match.group(1))
+        user_jobs: Sequence[dict] = context.user_data.get("jobs", ())
+        if job_index >= len(user_jobs):
+            await query.answer("Something went wrong. Please try again.")
             return
 
-        self.bot.manager_service.job_rm(request_user=build_request_user(request_user), job_id=job["job"]["service"])
+        job: dict = user_jobs[job_index]
+
+        await asyncio.to_thread(
+            self.bot.manager_service.job_rm, request_user=build_request_user(request_user), job_id=job["job"]["service"]
+        )
 
-        return self.job_list(update=update, context=context)
+        return await self.job_list(update=update, context=context)
 
 
 def build_handler(bot: BeersBot) -> ConversationHandler:
+    from telegram.ext import CallbackQueryHandler, MessageHandler, TypeHandler, filters
+
     job_handler = JobHandler(bot=bot)
 
     return ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(job_handler.job_new, pass_user_data=True, pattern=f"^{_CB_JOB_NEW}"),
-            CallbackQueryHandler(job_handler.job_list, pass_user_data=True, pattern=f"^{_CB_JOB_LIST}"),
+            CallbackQueryHandler(job_handler.job_new, pattern=_CB_JOB_NEW_RE),
+            CallbackQueryHandler(job_handler.job_list, pattern=_CB_JOB_LIST_RE),
         ],
         states={
-            JobStates.GPU: [MessageHandler(Filters.regex("^\\d+$"), job_handler.gpu)],
+            JobStates.GPU: [MessageHandler(_DIGIT_FILTER, job_handler.gpu)],
             JobStates.IMAGE: [
-                MessageHandler(Filters.text, job_handler.image),
-                CallbackQueryHandler(job_handler.image_cb, pass_user_data=True, pattern=f"^{_CB_IMAGE_PREFIX}"),
+                MessageHandler(filters.TEXT, job_handler.image),
+                CallbackQueryHandler(job_handler.image_cb, pattern=_CB_IMAGE_RE),
             ],
             JobStates.MOUNT_SOURCE: [
-                CallbackQueryHandler(job_handler.mount_source_cb, pass_user_data=True, pattern=f"^{_CB_MOUNT_SOURCE}"),
+                CallbackQueryHandler(job_handler.mount_source_cb, pattern=_CB_MOUNT_SOURCE_RE),
             ],
             JobStates.MOUNT_TARGET: [
-                CallbackQueryHandler(job_handler.mount_target_cb, pass_user_data=True, pattern=f"^{_CB_MOUNT_TARGET}"),
-                MessageHandler(Filters.text, job_handler.mount_target),
-            ],
-            JobStates.DURATION: [MessageHandler(Filters.regex("^\\d+$"), job_handler.duration)],
-            JobStates.CONFIRM: [
-                CallbackQueryHandler(job_handler.confirm, pass_user_data=True, pattern=f"^{_CB_FINAL}")
+                CallbackQueryHandler(job_handler.mount_target_cb, pattern=_CB_MOUNT_TARGET_RE),
+                MessageHandler(filters.TEXT, job_handler.mount_target),
             ],
+            JobStates.DURATION: [MessageHandler(_DIGIT_FILTER, job_handler.duration)],
+            JobStates.CONFIRM: [CallbackQueryHandler(job_handler.confirm, pattern=_CB_FINAL_RE)],
             JobStates.INFO: [
-                CallbackQueryHandler(job_handler.job_info, pass_user_data=True, pattern=f"^{_CB_JOB_INFO}"),
-                CallbackQueryHandler(job_handler.job_reload, pass_user_data=True, pattern=f"^{_CB_JOB_LIST_RELOAD}"),
-            ],
-            JobStates.REMOVE: [
-                CallbackQueryHandler(job_handler.job_rm, pass_user_data=True, pattern=f"^{_CB_JOB_REMOVE}")
+                CallbackQueryHandler(job_handler.job_info, pattern=_CB_JOB_INFO_RE),
+                CallbackQueryHandler(job_handler.job_reload, pattern=_CB_JOB_LIST_RELOAD_RE),
             ],
+            JobStates.REMOVE: [CallbackQueryHandler(job_handler.job_rm, pattern=_CB_JOB_REMOVE_RE)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, job_handler.timeout)],
         },
-        fallbacks=[MessageHandler(Filters.text, job_handler.fallback)],
+        fallbacks=[MessageHandler(filters.TEXT, job_handler.fallback)],
         allow_reentry=True,
+        conversation_timeout=_CONVERSATION_TIMEOUT,
+        name="job",
+        persistent=bot.application.persistence is not None,
     )
@@ -0,0 +1,97 @@
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+from redis.asyncio import Redis
+from telegram.ext import BasePersistence, PersistenceInput
+
+_KEY_PREFIX: str = "beers:session"
+_KEY_SEP: str = ":"
+
+ConversationKey = Tuple[int, ...]
+ConversationDict = Dict[ConversationKey, object]
+
+
+class RedisPersistence(BasePersistence):
+    """Persist the user data and the conversation states in Redis.
+
+    Every entry expires after `ttl` seconds without updates, so abandoned conversations are eventually dropped.
+    Chat, bot and callback data are not used by the bot and are not stored.
+    """
+
+    def __init__(self, redis_url: str, ttl: int = 3600, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.redis: Redis = Redis.from_url(redis_url)
+        self.ttl: int = ttl
+
+    @staticmethod
+    def _user_key(user_id: int) -> str:
+        return _KEY_SEP.join((_KEY_PREFIX, "user_data", str(user_id)))
+
+    @staticmethod
+    def _conversation_key(name: str, key: ConversationKey) -> str:
+        return _KEY_SEP.join((_KEY_PREFIX, "conversation", name, *(str(x) for x in key)))
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        user_data: Dict[int, Dict[Any, Any]] = {}
+        async for key in self.redis.scan_iter(match=self._user_key("*")):
+            if (value := await self.redis.get(key)) is not None:
+                user_data[int(key.decode().rsplit(_KEY_SEP, 1)[-1])] = orjson.loads(value)
+        return user_data
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        await self.redis.set(self._user_key(user_id), orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS), ex=self.ttl)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self.redis.delete(self._user_key(user_id))
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def get_conversations(self, name: str) -> ConversationDict:
+        conversations: ConversationDict = {}
+        prefix: str = self._conversation_key(name, ())
+        async for key in self.redis.scan_iter(match=f"{prefix}{_KEY_SEP}*"):
+            if (value := await self.redis.get(key)) is not None:
+                conversation_key = tuple(int(x) for x in key.decode()[len(prefix) + 1 :].split(_KEY_SEP))
+                conversations[conversation_key] = orjson.loads(value)
+        return conversations
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: Optional[object]) -> None:
+        redis_key: str = self._conversation_key(name, key)
+        if new_state is None:
+            await self.redis.delete(redis_key)
+        else:
+            await self.redis.set(redis_key, orjson.dumps(new_state), ex=self.ttl)
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def flush(self) -> None:
+        await self.redis.aclose()
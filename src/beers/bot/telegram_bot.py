@@ -1,8 +1,11 @@
+import asyncio
 import logging
+import secrets
+from typing import Optional
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message, MessageEntity, Update, User
-from telegram.ext import CallbackContext, CommandHandler, Filters, Updater
-from telegram.utils.helpers import escape_markdown
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, User
+from telegram.ext import AIORateLimiter, Application, ApplicationBuilder, CommandHandler, ContextTypes, filters
+from telegram.helpers import escape_markdown
 
 import beers  # noqa
 from beers.bot import build_request_user
@@ -13,31 +16,49 @@ pylogger = logging.getLogger(__name__)
 _CB_JOB_NEW: str = "cb_job_new#"
 _CB_JOB_LIST: str = "cb_job_list#"
 
+# Bot API limits: ~30 messages per second overall and 20 messages per minute in the same group
+_RATE_LIMIT_OVERALL: int = 30
+_RATE_LIMIT_GROUP: int = 20
+_CONNECTION_POOL_SIZE: int = 1024
+_POOL_TIMEOUT: float = 30.0
+_WEBHOOK_PORT: int = 8443
+
 
 class BeersBot:
-    def __init__(self, bot_token: str, manager_url: str):
-        self.updater = Updater(token=bot_token, use_context=True)
+    def __init__(self, bot_token: str, manager_url: str, redis_url: Optional[str] = None):
+        builder: ApplicationBuilder = (
+            Application.builder()
+            .token(bot_token)
+            .concurrent_updates(True)
+            .rate_limiter(
+                AIORateLimiter(
+                    overall_max_rate=_RATE_LIMIT_OVERALL,
+                    overall_time_period=1,
+                    group_max_rate=_RATE_LIMIT_GROUP,
+                    group_time_period=60,
+                )
+            )
+            .connection_pool_size(_CONNECTION_POOL_SIZE)
+            .pool_timeout(_POOL_TIMEOUT)
+        )
+        if redis_url:
+            from beers.bot.persistence import RedisPersistence
+
+            builder = builder.persistence(RedisPersistence(redis_url=redis_url))
+        self.application: Application = builder.build()
         self.manager_service: ManagerAPI = ManagerAPI(manager_url=manager_url)
         if not self.manager_service.check_connection():
             raise RuntimeError(f"Error connecting to BeER manager at: {self.manager_service.manager_url}")
 
-    def strip_command(self, message: Message):
-        command_entities = [entity for entity in message.entities if entity.type == MessageEntity.BOT_COMMAND]
-        assert len(command_entities) == 1
-        command_entity: MessageEntity = command_entities[0]
-        assert command_entity.offset == 0
-
-        return message.text[command_entity.length :]
-
-    def register_user(self, update: Update, context: CallbackContext):
+    async def register_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         request_user: User = update.effective_user
-        # Parse parameters
-        params_str: str = self.strip_command(message=update.message)
+        # Parse parameters: CommandHandler already split the text following the command
+        params_str: str = " ".join(context.args)
         try:
-            user_to_add: str = params_str.strip()
+            (user_to_add,) = context.args
             user_to_add: int = int(user_to_add)
         except ValueError:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text=escape_markdown(f"Error parsing the parameters '{params_str}'", version=2),
                 parse_mode="MarkdownV2",
@@ -45,27 +66,24 @@ class BeersBot:
             return
 
         # Add the user
-        register_message: ManagerAnswer = self.manager_service.register_user(
-            request_user=build_request_user(request_user), user_id=str(user_to_add)
+        register_message: ManagerAnswer = await asyncio.to_thread(
+            self.manager_service.register_user, request_user=build_request_user(request_user), user_id=str(user_to_add)
         )
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text=escape_markdown(register_message.message, version=2),
             parse_mode="MarkdownV2",
         )
 
-    def set_permission(self, update: Update, context: CallbackContext):
-        # Parse parameters
-        params_str: str = self.strip_command(message=update.message)
+    async def set_permission(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Parse parameters: CommandHandler already split the text following the command
+        params_str: str = " ".join(context.args)
         try:
-            user_to_add, *permission_str = params_str.strip().split()
+            user_to_add, permission_str = context.args
             user_to_add = int(user_to_add)
-            if len(permission_str) != 1:
-                raise ValueError
-
-            permission_level = PermissionLevel[permission_str[0]]
-        except ValueError:
-            context.bot.send_message(
+            permission_level = PermissionLevel[permission_str]
+        except (ValueError, KeyError):
+            await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text=escape_markdown(f"Error parsing the parameters '{params_str}'", version=2),
                 parse_mode="MarkdownV2",
@@ -74,18 +92,21 @@ class BeersBot:
 
         request_user: User = update.effective_user
         # Update the user with the chosen permissions
-        update_message: ManagerAnswer = self.manager_service.set_permission(
-            request_user=build_request_user(request_user), user_id=str(user_to_add), permission_level=permission_level
+        update_message: ManagerAnswer = await asyncio.to_thread(
+            self.manager_service.set_permission,
+            request_user=build_request_user(request_user),
+            user_id=str(user_to_add),
+            permission_level=permission_level,
         )
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text=escape_markdown(update_message.message, version=2),
             parse_mode="MarkdownV2",
         )
 
-    def set_ssh_key(self, update: Update, context: CallbackContext):
+    async def set_ssh_key(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if (original := update.message.reply_to_message) is None:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 # TODO
                 text="You must use the /set_ssh_key command replying to the file containing the actual public key (which has to be sent before)",
@@ -96,48 +117,65 @@ class BeersBot:
 
         request_user: User = update.effective_user
 
-        update_message: ManagerAnswer = self.manager_service.set_ssh_key(
-            request_user=build_request_user(request_user), ssh_key=ssh_key
+        update_message: ManagerAnswer = await asyncio.to_thread(
+            self.manager_service.set_ssh_key, request_user=build_request_user(request_user), ssh_key=ssh_key
         )
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text=update_message.message,
             parse_mode="HTML",
         )
 
-    def delete_user(self, update: Update, context: CallbackContext):
+    async def delete_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         # TODO
         raise NotImplementedError
 
-    def job(self, update: Update, context: CallbackContext):
+    async def job(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         # TODO: check API permission
         actions = [
             InlineKeyboardButton(text=action_name, callback_data=action_cb)
             for action_name, action_cb in (("List Active Jobs", _CB_JOB_LIST), ("New Job", _CB_JOB_NEW))
         ]
 
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text="Please select an action",
             parse_mode="HTML",
             reply_markup=InlineKeyboardMarkup([actions]),
         )
 
-    def run(self):
-        dispatcher = self.updater.dispatcher
+    def run(self, webhook_url: Optional[str] = None, webhook_port: int = _WEBHOOK_PORT):
+        application = self.application
 
-        dispatcher.add_handler(
-            CommandHandler("set_permission", self.set_permission, filters=~Filters.update.edited_message)
+        application.add_handler(
+            CommandHandler("set_permission", self.set_permission, filters=~filters.UpdateType.EDITED_MESSAGE)
+        )
+        application.add_handler(
+            CommandHandler("register_user", self.register_user, filters=~filters.UpdateType.EDITED_MESSAGE)
         )
-        dispatcher.add_handler(
-            CommandHandler("register_user", self.register_user, filters=~Filters.update.edited_message)
+        application.add_handler(
+            CommandHandler("set_ssh_key", self.set_ssh_key, filters=~filters.UpdateType.EDITED_MESSAGE)
         )
-        dispatcher.add_handler(CommandHandler("set_ssh_key", self.set_ssh_key, filters=~Filters.update.edited_message))
-        dispatcher.add_handler(CommandHandler("delete_user", self.delete_user, filters=~Filters.update.edited_message))
-        dispatcher.add_handler(CommandHandler("job", self.job, filters=~Filters.update.edited_message))
+        application.add_handler(
+            CommandHandler("delete_user", self.delete_user, filters=~filters.UpdateType.EDITED_MESSAGE)
+        )
+        application.add_handler(CommandHandler("job", self.job, filters=~filters.UpdateType.EDITED_MESSAGE))
 
         from beers.bot import job
 
-        dispatcher.add_handler(job.build_handler(bot=self))
+        application.add_handler(job.build_handler(bot=self))
 
-        self.updater.start_polling()
+        try:
+            if webhook_url:
+                # Telegram pushes the updates to us instead of waiting for the next long-poll round
+                url_path: str = secrets.token_urlsafe(32)
+                application.run_webhook(
+                    listen="0.0.0.0",
+                    port=webhook_port,
+                    url_path=url_path,
+                    webhook_url=f"{webhook_url.rstrip('/')}/{url_path}",
+                )
+            else:
+                application.run_polling()
+        finally:
+            self.manager_service.close()
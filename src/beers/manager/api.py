@@ -1,13 +1,15 @@
-import json
 from enum import Enum, auto
-from typing import Any, Callable, Mapping
+from typing import Any, Callable, FrozenSet, Mapping, Optional, Tuple
 
+import msgpack
+import orjson
 import requests
-from pydantic import BaseModel
 from requests import Response
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 from beers.models import JobRequestModel, RequestUser
-from beers.utils import StrEnum
+from beers.utils import ORJSONModel, StrEnum
 
 
 class PermissionLevel(Enum):
@@ -16,8 +18,13 @@ class PermissionLevel(Enum):
     USER = 2
 
     def higher_permission(self) -> "PermissionLevel":
-        permission = list(PermissionLevel)[max(0, list(PermissionLevel).index(self) - 1)]
-        return permission
+        return _HIGHER_PERMISSION[self]
+
+
+# Each level mapped to the one right above it (the highest one to itself), computed once
+_HIGHER_PERMISSION: Mapping[PermissionLevel, PermissionLevel] = {
+    level: list(PermissionLevel)[max(0, i - 1)] for i, level in enumerate(PermissionLevel)
+}
 
 
 class ReturnCodes(StrEnum):
@@ -40,10 +47,14 @@ class ReturnCodes(StrEnum):
     KEY_CHECK = auto()
     JOB_LIST = auto()
     JOB_REMOVE_OK = auto()
+    BOOTSTRAP = auto()
 
     @property
-    def is_error(self):
-        return "error" in self.name.lower()
+    def is_error(self) -> bool:
+        return self in _ERROR_CODES
+
+
+_ERROR_CODES: FrozenSet[ReturnCodes] = frozenset(code for code in ReturnCodes if "error" in code.name.lower())
 
 
 MESSAGE_FORMAT: Mapping[ReturnCodes, Callable] = {}
@@ -61,7 +72,7 @@ MESSAGE_TEMPLATES: Mapping[ReturnCodes, str] = {
 }
 
 
-class ManagerAnswer(BaseModel):
+class ManagerAnswer(ORJSONModel):
     code: ReturnCodes
     data: Mapping[str, Any] = {}
 
@@ -72,103 +83,108 @@ class ManagerAnswer(BaseModel):
         if self.code in MESSAGE_TEMPLATES:
             return MESSAGE_TEMPLATES[self.code]
 
-        return f"{self.code}:\n\n{json.dumps(self.data, indent=4)}"
+        return f"{self.code}:\n\n{orjson.dumps(self.data, option=orjson.OPT_INDENT_2).decode()}"
+
+
+# The bot issues the requests from a thread pool: keep enough idle connections for all of its threads
+_POOL_MAXSIZE: int = 32
+_CONNECT_RETRIES: int = 3
+# (connect, read) timeouts in seconds: dispatching a job waits for Docker on the manager side
+_TIMEOUT: Tuple[float, float] = (5.0, 60.0)
+_JSON_HEADERS: Mapping[str, str] = {"Content-Type": "application/json"}
+# The answers can be exchanged as msgpack, which is more compact and faster to decode than JSON
+MSGPACK_MEDIA_TYPE: str = "application/msgpack"
+
+
+def _request_user_payload(request_user: RequestUser) -> Mapping[str, Any]:
+    # The shape is fixed: a literal is much cheaper than walking the pydantic fields with .dict()
+    return {"user_id": request_user.user_id, "username": request_user.username, "full_name": request_user.full_name}
+
+
+def _parse_answer(response: Response) -> ManagerAnswer:
+    if response.headers.get("Content-Type", "").startswith(MSGPACK_MEDIA_TYPE):
+        answer: Mapping[str, Any] = msgpack.unpackb(response.content)
+    else:
+        answer: Mapping[str, Any] = orjson.loads(response.content)
+    # The manager is the only producer of the answers: skip the pydantic validation, only the code needs converting
+    return ManagerAnswer.construct(code=ReturnCodes(answer["code"]), data=answer.get("data", {}))
 
 
 class ManagerAPI:
     def __init__(self, manager_url: str):
         self.manager_url: str = manager_url
 
-    def _request(self, endpoint: str, **kwargs) -> Response:
-        return requests.post(f"{self.manager_url}/{endpoint}", **kwargs)
-
-    def register_user(self, request_user: RequestUser, user_id: str) -> ManagerAnswer:
-        response: Response = self._request(
-            endpoint="register_user",
-            json=dict(request_user=request_user.dict(), user_id=user_id),
+        # A single session keeps the connections to the manager alive across requests
+        self.session: requests.Session = requests.Session()
+        # Only failed connection attempts are retried: the request never reached the manager, so even a job
+        # submission is safe to resend
+        adapter: HTTPAdapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=_POOL_MAXSIZE,
+            max_retries=Retry(total=_CONNECT_RETRIES, connect=_CONNECT_RETRIES, read=0, status=0, backoff_factor=0.1),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # The manager falls back to JSON for the answers it does not encode as msgpack
+        self.session.headers["Accept"] = f"{MSGPACK_MEDIA_TYPE}, application/json"
+
+    def __enter__(self) -> "ManagerAPI":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _call(self, endpoint: str, payload: Optional[Any] = None) -> ManagerAnswer:
+        # Encode the body with orjson rather than letting requests run it through the stdlib json
+        response: Response = self.session.post(
+            f"{self.manager_url}/{endpoint}",
+            data=None if payload is None else orjson.dumps(payload),
+            headers=None if payload is None else _JSON_HEADERS,
+            timeout=_TIMEOUT,
         )
-        response: Mapping[str, Any] = response.json()
+        return _parse_answer(response)
 
-        return ManagerAnswer(**response)
+    def register_user(self, request_user: RequestUser, user_id: str) -> ManagerAnswer:
+        return self._call("register_user", dict(request_user=_request_user_payload(request_user), user_id=user_id))
 
     def set_permission(
         self, request_user: RequestUser, user_id: str, permission_level: PermissionLevel
     ) -> ManagerAnswer:
-        response: Response = self._request(
-            endpoint="set_permission",
-            json=dict(
-                request_user=request_user.dict(),
-                user_id=user_id,
-                permission_level=permission_level,
-            ),
+        return self._call(
+            "set_permission",
+            dict(request_user=_request_user_payload(request_user), user_id=user_id, permission_level=permission_level),
         )
-        response: Mapping[str, Any] = response.json()
-
-        return ManagerAnswer(**response)
 
     def list_resources(self, request_user: RequestUser) -> ManagerAnswer:
-        response: Response = self._request(
-            endpoint="list_resources",
-            json=dict(request_user=request_user.dict(), only_available=True, only_online=True),
+        return self._call(
+            "list_resources",
+            dict(request_user=_request_user_payload(request_user), only_available=True, only_online=True),
         )
-        response: Mapping[str, Any] = response.json()
-        return ManagerAnswer(**response)
 
     def job(self, request_user: RequestUser, job: JobRequestModel) -> ManagerAnswer:
-        response: Response = self._request(
-            endpoint="job",
-            json=dict(
-                request_user=request_user.dict(),
-                job=job.dict(),
-            ),
-        )
-        response: Mapping[str, Any] = response.json()
-        return ManagerAnswer(**response)
+        return self._call("job", dict(request_user=_request_user_payload(request_user), job=job.dict()))
 
     def set_ssh_key(self, request_user: RequestUser, ssh_key: str) -> ManagerAnswer:
-        response: Response = self._request(
-            endpoint="set_ssh_key",
-            json=dict(request_user=request_user.dict(), ssh_key=ssh_key),
-        )
-
-        response: Mapping[str, Any] = response.json()
-        return ManagerAnswer(**response)
+        return self._call("set_ssh_key", dict(request_user=_request_user_payload(request_user), ssh_key=ssh_key))
 
     def check_connection(self) -> bool:
-        response: Response = self._request(
-            endpoint="ready",
-        )
-
-        response: Mapping[str, Any] = response.json()
+        return self._call("ready").code == ReturnCodes.READY
 
-        return ManagerAnswer(**response).code == ReturnCodes.READY
+    def bootstrap(self, request_user: RequestUser) -> ManagerAnswer:
+        return self._call("session_bootstrap", _request_user_payload(request_user))
 
     def check_ssh_key(self, request_user: RequestUser) -> bool:
-        response: Response = self._request(
-            endpoint="check_ssh_key",
-            json=request_user.dict(),
-        )
-        response: Mapping[str, Any] = response.json()
-
+        answer: ManagerAnswer = self._call("check_ssh_key", _request_user_payload(request_user))
         try:
-            return ManagerAnswer(**response).data["is_set"]
+            return answer.data["is_set"]
         except Exception:
             return False
 
     def job_list(self, request_user: RequestUser) -> ManagerAnswer:
-        response: Response = self._request(
-            endpoint="job_list",
-            json=request_user.dict(),
-        )
-        response: Mapping[str, Any] = response.json()
-
-        return ManagerAnswer(**response)
+        return self._call("job_list", _request_user_payload(request_user))
 
     def job_rm(self, request_user: RequestUser, job_id: str) -> ManagerAnswer:
-        response: Response = self._request(
-            endpoint="job_remove",
-            json=dict(request_user=request_user.dict(), job_id=job_id),
-        )
-        response: Mapping[str, Any] = response.json()
-
-        return ManagerAnswer(**response)
+        return self._call("job_remove", dict(request_user=_request_user_payload(request_user), job_id=job_id))
@@ -1,19 +1,18 @@
-import itertools
 import logging
-import operator
 from pathlib import Path
-from typing import Mapping, Sequence
+from typing import Any, List, Mapping, Optional, Sequence, Set, Tuple
 
 import orjson
 from peewee import (
+    JOIN,
     CharField,
     DateTimeField,
+    Field,
     FixedCharField,
     ForeignKeyField,
     IntegerField,
     IPField,
     Model,
-    ModelSelect,
     ModelUpdate,
     SqliteDatabase,
 )
@@ -45,21 +44,37 @@ class User(Model):
         database = _db
 
     @classmethod
-    def permission_check(cls, user_id: str, required_level: int) -> bool:
-        matching_users: ModelSelect = User.select().where(User.id == user_id)
-
-        return (user := matching_users.get_or_none()) is not None and user.permission_level <= required_level
+    def fetch_for_auth(cls, user_id: str) -> Optional["User"]:
+        return User.get_or_none(User.id == user_id)
 
     @classmethod
-    def is_registered(cls, user_id: str) -> bool:
-        matching_users: ModelSelect = User.select().where(User.id == user_id)
-        return matching_users.get_or_none() is not None
+    def load_with_worker(cls, user_id: str, hostname: str) -> Tuple["User", "Worker"]:
+        # Fetch the user and the worker in a single round-trip, raising DoesNotExist like get_by_id if either is missing
+        user_fields: Sequence[Field] = User._meta.sorted_fields
+        worker_fields: Sequence[Field] = Worker._meta.sorted_fields
+        row: Tuple[Any, ...] = (
+            User.select(*user_fields, *worker_fields)
+            .join(Worker, JOIN.CROSS)
+            .where((User.id == user_id) & (Worker.hostname == hostname))
+            .tuples()
+            .get()
+        )
+
+        user: User = User(**{field.name: value for field, value in zip(user_fields, row)})
+        worker: Worker = Worker(**{field.name: value for field, value in zip(worker_fields, row[len(user_fields) :])})
+        return user, worker
 
     @classmethod
     def register(cls, user_id: str, permission_level: PermissionLevel) -> str:
         # TODO: check consistency/update in DB
         return User.replace(id=user_id, permission_level=permission_level.value).execute()
 
+    @classmethod
+    def register_new(cls, user_id: str, permission_level: PermissionLevel) -> bool:
+        # Unlike register, an existing user is left untouched: returns whether the user was inserted
+        insert = User.insert(id=user_id, permission_level=permission_level.value).on_conflict_ignore()
+        return insert.as_rowcount().execute() > 0
+
     @classmethod
     def update_permissions(cls, user_id: str, permission_level: PermissionLevel):
         update: ModelUpdate = User.update(permission_level=permission_level.value).where(User.id == user_id)
@@ -87,25 +102,47 @@ class Worker(Model):
 
     @classmethod
     def register(cls, worker_model: WorkerModel) -> "Worker":
-        worker: Worker = Worker.select().where(Worker.hostname == worker_model.hostname).get_or_none()
-
-        if worker is not None:
-            pylogger.info(f"Updating existing worker {worker} to {worker_model}")
-            worker.ip = worker_model.external_ip
-            worker.info = worker_model.info
-            worker.local_nfs_root = worker_model.local_nfs_root
-            worker.save(only=[Worker.ip, Worker.info, Worker.local_nfs_root])
-        else:
-            pylogger.info(f"Registering new worker {worker_model}")
-            worker = Worker.create(
-                hostname=worker_model.hostname,
-                ip=worker_model.external_ip,
-                info=worker_model.info,
-                local_nfs_root=worker_model.local_nfs_root,
-            )
-
-        for gpu in worker_model.gpus:
-            GPU.register(gpu_model=gpu, worker_id=worker.hostname)
+        # The worker update and the GPU inserts are committed together
+        with _db.atomic():
+            worker: Worker = Worker.select().where(Worker.hostname == worker_model.hostname).get_or_none()
+
+            if worker is not None:
+                pylogger.info("Updating existing worker %s to %s", worker, worker_model)
+                worker.ip = worker_model.external_ip
+                worker.info = worker_model.info
+                worker.local_nfs_root = worker_model.local_nfs_root
+                worker.save(only=[Worker.ip, Worker.info, Worker.local_nfs_root])
+            else:
+                pylogger.info("Registering new worker %s", worker_model)
+                worker = Worker.create(
+                    hostname=worker_model.hostname,
+                    ip=worker_model.external_ip,
+                    info=worker_model.info,
+                    local_nfs_root=worker_model.local_nfs_root,
+                )
+
+            # Insert the GPUs not known yet in bulk: one query for the existing ones and one for the new ones
+            incoming_gpus: Mapping[str, NvidiaGPU] = {gpu.uuid: gpu for gpu in worker_model.gpus}
+            existing_uuids: Set[str] = {
+                uuid
+                for (uuid,) in GPU.select(GPU.uuid)
+                .where((GPU.worker == worker.hostname) & (GPU.uuid << list(incoming_gpus)))
+                .tuples()
+            }
+            new_gpus: List[Mapping[str, Any]] = [
+                dict(
+                    worker=worker.hostname,
+                    uuid=uuid,
+                    name=gpu.name,
+                    index=gpu.index,
+                    total_memory=gpu.total_memory,
+                    info=gpu.info,
+                )
+                for uuid, gpu in incoming_gpus.items()
+                if uuid not in existing_uuids
+            ]
+            if len(new_gpus) > 0:
+                GPU.insert_many(new_gpus).execute()
 
         return worker
 
@@ -128,28 +165,6 @@ class GPU(Model):
         database = _db
         indexes = [(("worker", "index"), True)]
 
-    @classmethod
-    def register(cls, gpu_model: NvidiaGPU, worker_id) -> "GPU":
-        gpu: GPU = GPU.select().where((GPU.worker == worker_id) & (GPU.uuid == gpu_model.uuid)).get_or_none()
-
-        if gpu is None:
-            gpu = GPU.create(
-                worker=worker_id,
-                uuid=gpu_model.uuid,
-                name=gpu_model.name,
-                index=gpu_model.index,
-                total_memory=gpu_model.total_memory,
-                info=gpu_model.info,
-            )
-
-        return gpu
-
-    @classmethod
-    def by_workers(cls, worker_ids: Sequence[str]) -> Mapping[Worker, Sequence["GPU"]]:
-        worker_ids = list(worker_ids)
-        gpus = list(cls.select().where(GPU.worker << worker_ids))
-        return {worker: list(items) for worker, items in itertools.groupby(gpus, key=operator.attrgetter("worker"))}
-
 
 class Job(Model):
     name = CharField()
@@ -171,7 +186,8 @@ class Job(Model):
 
 
 def init(owner_id: str, db_path: Path):
-    _db.init(db_path)
+    # WAL with NORMAL synchronous mode avoids an fsync of the whole journal on every commit
+    _db.init(db_path, pragmas={"journal_mode": "wal", "synchronous": "normal"})
     _db.connect(reuse_if_open=True)
     _db.create_tables(models=[User, Worker, Job, GPU])
     User.register(user_id=owner_id, permission_level=PermissionLevel.OWNER)
@@ -1,24 +1,34 @@
+import functools
+import itertools
 import logging
-import time
-from datetime import datetime, timedelta
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+from enum import Enum
 from pathlib import Path
-from typing import Any, List, Mapping, Optional, Sequence, Set, Tuple
+from typing import Any, Callable, Coroutine, Dict, List, Mapping, Optional, Sequence, Set, Tuple, Type
 
+import anyio
+import msgpack
 import orjson
+from cachetools import TTLCache, cached
 from docker.errors import APIError, NotFound
 from docker.models.configs import Config
 from docker.models.nodes import Node
 from docker.models.services import Service
 from docker.types import ConfigReference, DriverConfig, EndpointSpec, Mount
 from fastapi import Body, FastAPI
-from playhouse.shortcuts import model_to_dict
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 import beers  # noqa
 import docker
 from beers.manager import beer_db
-from beers.manager.api import ManagerAnswer, PermissionLevel, ReturnCodes
+from beers.manager.api import MSGPACK_MEDIA_TYPE, ManagerAnswer, PermissionLevel, ReturnCodes
 from beers.manager.beer_db import GPU, DBError, Job, User, Worker
 from beers.models import JobRequestModel, RequestUser, WorkerModel
 from beers.utils import run_service
@@ -39,6 +49,26 @@ _LABEL_NFS_SERVER: str = "beers.nfs_server"
 
 _CONFIG_PREFIX: str = "beer_ssh-key_"
 
+_TASK_FIELDS: Tuple[str, ...] = ("ID", "DesiredState", "Status")
+
+# The swarm nodes are listed at most once every few seconds, however many users ask for the resources
+_ONLINE_WORKERS_CACHE: TTLCache = TTLCache(maxsize=1, ttl=5)
+_ONLINE_WORKERS_LOCK: threading.Lock = threading.Lock()
+# Same for the GPUs taken by the running services: the job endpoints clear it whenever they start or remove one
+_BUSY_GPUS_CACHE: TTLCache = TTLCache(maxsize=1, ttl=3)
+_BUSY_GPUS_LOCK: threading.Lock = threading.Lock()
+
+# The requesting users by id (None if not registered), every endpoint starts by fetching one to check its permissions.
+# The endpoints drop a user from here as soon as they change it
+_USERS_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=30)
+_USERS_CACHE_LOCK: threading.Lock = threading.Lock()
+
+# The user directories already created on the NFS servers, as (hostname, NFS root, address, user id). Creating them is
+# idempotent: after a restart they are simply created once more
+_NFS_USER_DIRS: Set[Tuple[str, str, str, str]] = set()
+
+_THREADPOOL_SIZE: int = 100
+
 
 class ORJSONResponse(JSONResponse):
     media_type = "application/json"
@@ -47,9 +77,86 @@ class ORJSONResponse(JSONResponse):
         return orjson.dumps(content)
 
 
+class MsgpackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, default=_msgpack_default)
+
+
+def _msgpack_default(obj: Any) -> Any:
+    # Mirror what orjson does natively for the types found in the answers
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    raise TypeError(f"Type is not msgpack serializable: {type(obj)}")
+
+
+# Whether the client of the request being served accepts msgpack answers
+_ACCEPTS_MSGPACK: ContextVar[bool] = ContextVar("accepts_msgpack", default=False)
+
+
+class AnswerFormatMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app: ASGIApp = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            # The sync endpoints run in a worker thread that inherits the context of the request
+            _ACCEPTS_MSGPACK.set(MSGPACK_MEDIA_TYPE in Headers(scope=scope).get("accept", ""))
+        await self.app(scope, receive, send)
+
+
+class ORJSONRequest(Request):
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+
+class ORJSONRoute(APIRoute):
+    # FastAPI reads the request bodies through Request.json, which uses the stdlib json
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        route_handler: Callable[[Request], Coroutine[Any, Any, Response]] = super().get_route_handler()
+
+        async def orjson_route_handler(request: Request) -> Response:
+            return await route_handler(ORJSONRequest(request.scope, request.receive))
+
+        return orjson_route_handler
+
+
 app = FastAPI(default_response_class=ORJSONResponse, debug=True)
+app.router.route_class = ORJSONRoute
+app.add_middleware(AnswerFormatMiddleware)
+
+
+@app.on_event("startup")
+async def _resize_threadpool() -> None:
+    # The endpoints are sync and spend most of their time waiting on Docker: let more of them run at once than
+    # the default 40 worker threads allow
+    anyio.to_thread.current_default_thread_limiter().total_tokens = _THREADPOOL_SIZE
+
+
+@functools.lru_cache(maxsize=None)
+def _empty_answer_body(code: ReturnCodes, response_class: Type[Response]) -> bytes:
+    # The answers without data never change: each one is serialized once per format
+    return response_class(content={_RETURN_CODE_KEY: code.value, _DATA_CODE_KEY: {}}).body
+
+
+def _answer(code: ReturnCodes, data: Optional[Mapping[str, Any]] = None) -> Response:
+    # Serialize the answer straight away: returning a ManagerAnswer would run it through jsonable_encoder first.
+    # The endpoints still declare ManagerAnswer as response_model, to document the schema
+    response_class: Type[Response] = MsgpackResponse if _ACCEPTS_MSGPACK.get() else ORJSONResponse
+    if data is None:
+        return Response(content=_empty_answer_body(code, response_class), media_type=response_class.media_type)
+    # Hand the encoders the plain string value: no Enum handling per answer
+    return response_class(content={_RETURN_CODE_KEY: code.value, _DATA_CODE_KEY: data})
+
 
 client = docker.from_env()
+# The Docker client is thread-safe: stay within its default connection pool size (10)
+_DOCKER_EXECUTOR: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="docker")
 
 
 def _update_nfs_nodes(workers: Sequence[Node]):
@@ -69,14 +176,22 @@ def _update_nfs_nodes(workers: Sequence[Node]):
         for worker in workers
     ]
 
+    # Only the directories not created yet: most calls add a single user or a single worker
+    missing_dirs: Set[Tuple[str, str, str, str]] = {
+        (hostname, nfs_root, address, user.id)
+        for hostname, nfs_root, address in hostname2nfs_root2address
+        for user in users
+    } - _NFS_USER_DIRS
+    if len(missing_dirs) == 0:
+        return
+    hostname2nfs_root2address = sorted(
+        {(hostname, nfs_root, address) for hostname, nfs_root, address, _ in missing_dirs}
+    )
+
     client.containers.run(
         image="alpine:latest",
         tty=True,
-        command=[
-            "mkdir",
-            "-p",
-            *(f"/data/{hostname}/{user}" for hostname, _, _ in hostname2nfs_root2address for user in users),
-        ],
+        command=["mkdir", "-p", *(f"/data/{hostname}/{user_id}" for hostname, _, _, user_id in sorted(missing_dirs))],
         mounts=[
             Mount(
                 target=f"/data/{hostname}",
@@ -95,11 +210,44 @@ def _update_nfs_nodes(workers: Sequence[Node]):
         ],
         remove=True,
     )
+    _NFS_USER_DIRS.update(missing_dirs)
+
+
+@cached(cache=_ONLINE_WORKERS_CACHE, lock=_ONLINE_WORKERS_LOCK)
+def _online_workers() -> List[str]:
+    # A single listing request returns the current state of every node: no need to reload them one by one.
+    # Docker cannot filter on the node state or availability, those are checked below
+    workers: List[Node] = client.nodes.list(filters={"role": "worker", "membership": "accepted"})
+
+    return [
+        node.attrs["Description"]["Hostname"]
+        for node in workers
+        if node.attrs["Status"]["State"] == "ready" and node.attrs["Spec"]["Availability"] == "active"
+    ]
+
+
+@cached(cache=_BUSY_GPUS_CACHE, lock=_BUSY_GPUS_LOCK)
+def _busy_gpus() -> Set[str]:
+    all_services: Sequence[Service] = client.services.list(filters={"label": _SERVICE_LABEL_GPUS})
+    return set(
+        itertools.chain.from_iterable(
+            service.attrs["Spec"]["Labels"][_SERVICE_LABEL_GPUS].split(_SERVICE_LABEL_GPU_SEP)
+            for service in all_services
+        )
+    )
 
 
+def _forget_busy_gpus() -> None:
+    # @cached does not hold the lock while listing the services: a _busy_gpus call started before a service was
+    # created or removed can still store its stale set after this clear. It then lasts at most the cache TTL
+    with _BUSY_GPUS_LOCK:
+        _BUSY_GPUS_CACHE.clear()
+
+
+@app.get("/ready")
 @app.post("/ready")
 def is_ready():
-    return ManagerAnswer(code=ReturnCodes.READY)
+    return _answer(code=ReturnCodes.READY)
 
 
 @app.post("/join", response_model=ManagerAnswer)
@@ -108,11 +256,13 @@ def add_worker(worker_model: WorkerModel, request: Request):
     try:
         # DB registration
         worker = Worker.register(worker_model=worker_model)
+        with _ONLINE_WORKERS_LOCK:
+            _ONLINE_WORKERS_CACHE.clear()
 
         try:
             node: Node = client.nodes.get(worker.hostname)
         except APIError:
-            return ManagerAnswer(code=ReturnCodes.DOCKER_ERROR)
+            return _answer(code=ReturnCodes.DOCKER_ERROR)
 
         if worker.local_nfs_root is not None:
             # The correct flow is to call this endpoint AFTER joining the swarm via Docker, so we can assume the worker
@@ -122,181 +272,206 @@ def add_worker(worker_model: WorkerModel, request: Request):
             node.update(node_spec=specs)
 
             _update_nfs_nodes(workers=[node])
-        return ManagerAnswer(code=ReturnCodes.WORKER_INFO, data={"info": worker.__data__})
+        return _answer(code=ReturnCodes.WORKER_INFO, data={"info": worker.__data__})
     except DBError as e:
-        return ManagerAnswer(code=ReturnCodes.DB_ERROR, data={"message": e.message})
+        return _answer(code=ReturnCodes.DB_ERROR, data={"message": e.message})
 
 
-def permission_check(request_user: RequestUser, required_level: PermissionLevel) -> Optional[ManagerAnswer]:
-    User.update_details(user_id=request_user.user_id, username=request_user.username, full_name=request_user.full_name)
+@functools.lru_cache(maxsize=1)
+def _admin_usernames() -> str:
+    # Cleared whenever a permission level or the details of an admin change
+    admins: Sequence[User] = User.having_permission(permission_level=PermissionLevel.ADMIN.value)
+    return "\n".join(f"- @{admin.username}" for admin in admins if admin.username is not None)
 
-    if required_level == PermissionLevel.USER and not User.is_registered(user_id=request_user.user_id):
-        pylogger.debug(f"<permission_check> User {request_user} not registered")
 
-        admins = User.having_permission(permission_level=PermissionLevel.ADMIN.value)
-        admins = [f"- @{admin.username}" for admin in admins if admin.username is not None]
-        admins = "\n".join(admins)
-        return ManagerAnswer(code=ReturnCodes.NOT_REGISTERED_ERROR, data={"admins": admins})
+def _fetch_user(user_id: str) -> Optional[User]:
+    with _USERS_CACHE_LOCK:
+        if user_id in _USERS_CACHE:
+            return _USERS_CACHE[user_id]
 
-    if not User.permission_check(user_id=request_user.user_id, required_level=required_level.value):
-        return ManagerAnswer(
-            code=ReturnCodes.PERMISSION_ERROR,
-        )
+    user: Optional[User] = User.fetch_for_auth(user_id=user_id)
+    with _USERS_CACHE_LOCK:
+        _USERS_CACHE[user_id] = user
+    return user
+
+
+def _forget_user(user_id: str) -> None:
+    with _USERS_CACHE_LOCK:
+        _USERS_CACHE.pop(user_id, None)
+
+
+def permission_check(
+    request_user: RequestUser, required_level: PermissionLevel
+) -> Tuple[Optional[User], Optional[Response]]:
+    # The requesting user is fetched once and handed back to the endpoint (None if not registered), together with
+    # the error answer to return, if any
+    user: Optional[User] = _fetch_user(user_id=request_user.user_id)
+
+    if user is not None and (user.username, user.full_name) != (request_user.username, request_user.full_name):
+        User.update_details(user_id=user.id, username=request_user.username, full_name=request_user.full_name)
+        user.username, user.full_name = request_user.username, request_user.full_name
+        if user.permission_level <= PermissionLevel.ADMIN.value:
+            _admin_usernames.cache_clear()
+
+    if required_level == PermissionLevel.USER and user is None:
+        pylogger.debug("<permission_check> User %s not registered", request_user)
+
+        return user, _answer(code=ReturnCodes.NOT_REGISTERED_ERROR, data={"admins": _admin_usernames()})
+
+    if user is None or user.permission_level > required_level.value:
+        return user, _answer(code=ReturnCodes.PERMISSION_ERROR)
+
+    return user, None
 
 
 @app.post("/set_permission", response_model=ManagerAnswer)
 def set_permission(
     request_user: RequestUser, user_id: str = Body(None), permission_level: PermissionLevel = Body(None)
 ):
-    if not permission_check(request_user=request_user, required_level=permission_level.higher_permission()):
-        return ManagerAnswer(code=ReturnCodes.PERMISSION_ERROR, data={})
-
-    if not User.is_registered(user_id=user_id):
-        return ManagerAnswer(code=ReturnCodes.NOT_REGISTERED_ERROR, data={"user_id": user_id})
+    _, permission_error = permission_check(
+        request_user=request_user, required_level=permission_level.higher_permission()
+    )
+    if permission_error is not None:
+        return permission_error
 
-    pylogger.info(f"Registering: {user_id} as {permission_level=}")
+    pylogger.info("Setting permission_level=%r for: %s", permission_level, user_id)
     try:
-        User.register(user_id=user_id, permission_level=permission_level)
-        return ManagerAnswer(
+        # A single UPDATE: no row changed means the user is not registered. The other columns are left untouched
+        if User.update_permissions(user_id=user_id, permission_level=permission_level) == 0:
+            return _answer(code=ReturnCodes.NOT_REGISTERED_ERROR, data={"user_id": user_id})
+        _forget_user(user_id=user_id)
+        _admin_usernames.cache_clear()
+        return _answer(
             # TODO: Change message/code
             code=ReturnCodes.REGISTRATION_SUCCESSFUL,
             data={"user_id": user_id, "permission_level": permission_level},
         )
     except Exception as e:
-        return ManagerAnswer(code=ReturnCodes.DB_ERROR, data={"args": e.args})
+        return _answer(code=ReturnCodes.DB_ERROR, data={"args": e.args})
 
 
 @app.post("/register_user", response_model=ManagerAnswer)
 def register_user(request_user: RequestUser, user_id: str = Body(None)):
-    if (
-        permission_error := permission_check(request_user=request_user, required_level=PermissionLevel.ADMIN)
-    ) is not None:
+    _, permission_error = permission_check(request_user=request_user, required_level=PermissionLevel.ADMIN)
+    if permission_error is not None:
         return permission_error
 
-    if User.is_registered(user_id=user_id):
-        return ManagerAnswer(code=ReturnCodes.ALREADY_REGISTERED_ERROR, data={"user_id": user_id})
-
-    pylogger.info(f"Registering: {user_id}")
+    pylogger.info("Registering: %s", user_id)
     try:
-        User.register(user_id=user_id, permission_level=PermissionLevel.USER)
+        # A single INSERT OR IGNORE: no row inserted means the user is already registered
+        if not User.register_new(user_id=user_id, permission_level=PermissionLevel.USER):
+            return _answer(code=ReturnCodes.ALREADY_REGISTERED_ERROR, data={"user_id": user_id})
+        _forget_user(user_id=user_id)
         nfs_workers: Sequence[Node] = [
             node for node in client.nodes.list() if _LABEL_NFS_SERVER in node.attrs["Spec"]["Labels"]
         ]
         _update_nfs_nodes(workers=nfs_workers)
-        return ManagerAnswer(code=ReturnCodes.REGISTRATION_SUCCESSFUL, data={"user_id": user_id})
+        return _answer(code=ReturnCodes.REGISTRATION_SUCCESSFUL, data={"user_id": user_id})
     except Exception as e:
-        return ManagerAnswer(code=ReturnCodes.DB_ERROR, data={"args": e.args})
+        return _answer(code=ReturnCodes.DB_ERROR, data={"args": e.args})
 
 
 @app.post("/set_ssh_key", response_model=ManagerAnswer)
 def set_ssh_key(request_user: RequestUser, ssh_key: str = Body(None)):
-    if (
-        permission_error := permission_check(request_user=request_user, required_level=PermissionLevel.USER)
-    ) is not None:
+    user, permission_error = permission_check(request_user=request_user, required_level=PermissionLevel.USER)
+    if permission_error is not None:
         return permission_error
-
-    user: User = User.get_by_id(request_user.user_id)
     config_name: str = f"{_CONFIG_PREFIX}{user.id}"
 
     try:
         # Even if configs.get is documented as working by id, it works by name too
         docker_config: Config = client.configs.get(config_name)
-        pylogger.info(f"Removing Docker config {docker_config.name}")
+        pylogger.info("Removing Docker config %s", docker_config.name)
         docker_config.remove()
     except NotFound:
         pass
     except APIError as e:
         # TODO
         if "in use by the following service" in e.explanation:
-            return ManagerAnswer(code=ReturnCodes.KEY_IN_USE_ERROR, data={})
+            return _answer(code=ReturnCodes.KEY_IN_USE_ERROR, data={})
 
     docker_config = client.configs.create(name=config_name, data=ssh_key)
     docker_config.reload()
 
     if docker_config.name != config_name:
-        return ManagerAnswer(
+        return _answer(
             code=ReturnCodes.RUNTIME_ERROR, data={"config_name": config_name, "docker_config_name": docker_config.name}
         )
 
+    # Drop the cached instance first: it must not keep the new key if saving it fails
+    _forget_user(user_id=user.id)
     user.public_ssh_key = ssh_key
 
     user.save(only=[User.public_ssh_key])
 
-    return ManagerAnswer(code=ReturnCodes.SET_KEY_SUCCESSFUL)
+    return _answer(code=ReturnCodes.SET_KEY_SUCCESSFUL)
 
 
 @app.post("/check_ssh_key", response_model=ManagerAnswer)
 def check_ssh_key(request_user: RequestUser):
-    if (
-        permission_error := permission_check(request_user=request_user, required_level=PermissionLevel.USER)
-    ) is not None:
+    user, permission_error = permission_check(request_user=request_user, required_level=PermissionLevel.USER)
+    if permission_error is not None:
         return permission_error
 
-    user: User = User.get_by_id(request_user.user_id)
-
-    return ManagerAnswer(code=ReturnCodes.KEY_CHECK, data={"is_set": user.public_ssh_key is not None})
+    return _answer(code=ReturnCodes.KEY_CHECK, data={"is_set": user.public_ssh_key is not None})
 
 
 @app.post("/job_remove", response_model=ManagerAnswer)
 def job_remove(request_user: RequestUser, job_id: str = Body(None)):
-    if (
-        permission_error := permission_check(request_user=request_user, required_level=PermissionLevel.USER)
-    ) is not None:
+    user, permission_error = permission_check(request_user=request_user, required_level=PermissionLevel.USER)
+    if permission_error is not None:
         return permission_error
-
-    user: User = User.get_by_id(request_user.user_id)
     job: Job = Job.get_by_id(job_id)
 
     if job.user.id == user.id or user.permission_level <= PermissionLevel.ADMIN.value:
-        now: float = time.time()
-        now: datetime = datetime.fromtimestamp(now)
+        now: datetime = datetime.now()
 
         client.services.get(service_id=job.service).remove()
+        _forget_busy_gpus()
         job.end_time = now
         job.save(only=[Job.end_time])
 
-        return ManagerAnswer(code=ReturnCodes.JOB_REMOVE_OK)
+        return _answer(code=ReturnCodes.JOB_REMOVE_OK)
     else:
-        return ManagerAnswer(
+        return _answer(
             code=ReturnCodes.PERMISSION_ERROR,
         )
 
 
 @app.post("/job", response_model=ManagerAnswer)
 def job_add(request_user: RequestUser, job: JobRequestModel = Body(None)):
-    if (
-        permission_error := permission_check(request_user=request_user, required_level=PermissionLevel.USER)
-    ) is not None:
+    _, permission_error = permission_check(request_user=request_user, required_level=PermissionLevel.USER)
+    if permission_error is not None:
         return permission_error
 
-    worker: Worker = Worker.get_by_id(pk=job.worker_hostname)
-    user: User = User.get_by_id(pk=job.user_id)
+    user, worker = User.load_with_worker(user_id=job.user_id, hostname=job.worker_hostname)
     if user.public_ssh_key is None:
-        return ManagerAnswer(code=ReturnCodes.KEY_MISSING_ERROR)
+        return _answer(code=ReturnCodes.KEY_MISSING_ERROR)
 
-    now: float = time.time()
-    now: datetime = datetime.fromtimestamp(now)
+    now: datetime = datetime.now()
     expire: datetime = now + timedelta(hours=job.expected_duration)
 
     try:
         docker_config: Config = client.configs.get(f"{_CONFIG_PREFIX}{user.id}")
     except NotFound:
-        return ManagerAnswer(code=ReturnCodes.KEY_MISSING_ERROR)
+        return _answer(code=ReturnCodes.KEY_MISSING_ERROR)
 
-    job_name: str = f"{job.user_id}_{now.strftime('%m%d%Y%H%M%S')}"
+    gpu_uuids: List[str] = [gpu["uuid"] for gpu in job.gpus]
+    job_name: str = f"{job.user_id}_{int(now.timestamp())}"
     service: Service = client.services.create(
         image=job.image,
         name=job_name,
         tty=True,
         labels={
             _SERVICE_LABEL_USER_ID: job.user_id,
-            _SERVICE_LABEL_EXPIRE: expire.strftime("%m%d%Y%H%M%S"),
-            _SERVICE_LABEL_GPUS: _SERVICE_LABEL_GPU_SEP.join(gpu["uuid"] for gpu in job.gpus),
+            # Unix timestamp, in seconds
+            _SERVICE_LABEL_EXPIRE: str(int(expire.timestamp())),
+            _SERVICE_LABEL_GPUS: _SERVICE_LABEL_GPU_SEP.join(gpu_uuids),
         },
         endpoint_spec=EndpointSpec(ports={None: (22, None, "host")}),
         constraints=[f"node.hostname=={worker.hostname}"],
         # resources=Resources(**job.resources.dict()),
-        env=[f"{_SWARM_RESOURCE}={gpu['uuid']}" for gpu in job.gpus],
+        env=[f"{_SWARM_RESOURCE}={gpu_uuid}" for gpu_uuid in gpu_uuids],
         configs=[
             ConfigReference(
                 config_id=docker_config.id,
@@ -322,7 +497,7 @@ def job_add(request_user: RequestUser, job: JobRequestModel = Body(None)):
         ]
         # args=["-d"],
     )
-    service.reload()
+    _forget_busy_gpus()
 
     Job.create(
         name=job_name,
@@ -333,36 +508,60 @@ def job_add(request_user: RequestUser, job: JobRequestModel = Body(None)):
         worker_info=worker.info,
         start_time=now,
         expected_end_time=expire,
-        gpu=job.gpus[0]["uuid"],  # TODO: add multi-gpu support on the DB side
+        gpu=gpu_uuids[0],  # TODO: add multi-gpu support on the DB side
     )
 
-    return ManagerAnswer(code=ReturnCodes.DISPATCH_OK, data={"service.attrs": service.attrs})
+    # The full service inspection is large and unused by the clients: only identify the service
+    return _answer(code=ReturnCodes.DISPATCH_OK, data={"service_id": service.id, "name": service.name})
+
+
+def _job_to_dict(job: Job) -> Mapping[str, Any]:
+    # Same nesting as model_to_dict(job), read straight from the loaded rows: the GPU owner is left as its id
+    return {
+        **job.__data__,
+        "user": job.user.__data__,
+        "gpu": {**job.gpu.__data__, "worker": job.gpu.worker.__data__},
+    }
+
+
+def _service_tasks(service: Service) -> List[Mapping[str, Any]]:
+    # Only the task fields the clients use: the full task specs would be sent and stored by the bot for nothing
+    return [{field: task.get(field) for field in _TASK_FIELDS} for task in service.tasks()]
 
 
 @app.post("/job_list", response_model=ManagerAnswer)
 def job_list(request_user: RequestUser):
-    if (
-        permission_error := permission_check(request_user=request_user, required_level=PermissionLevel.USER)
-    ) is not None:
+    user, permission_error = permission_check(request_user=request_user, required_level=PermissionLevel.USER)
+    if permission_error is not None:
         return permission_error
 
-    user: User = User.get_by_id(pk=request_user.user_id)
-
-    services: Sequence[Service] = [
-        service
-        for service in client.services.list(filters={"label": _SERVICE_LABEL_USER_ID})
-        if service.attrs["Spec"]["Labels"][_SERVICE_LABEL_USER_ID] == user.id
-    ]
+    # Let Docker match the label value, so that only the services of the user are listed
+    services: Sequence[Service] = client.services.list(filters={"label": f"{_SERVICE_LABEL_USER_ID}={user.id}"})
+
+    # One Docker request per service to get its tasks: issue them concurrently
+    services_tasks: List[List[Mapping[str, Any]]] = list(_DOCKER_EXECUTOR.map(_service_tasks, services))
+
+    # A single query for all the jobs, together with the rows they reference
+    jobs: Mapping[str, Job] = {
+        job.service: job
+        for job in Job.select(Job, User, GPU, Worker)
+        .join(User)
+        .switch(Job)
+        .join(GPU)
+        .join(Worker)
+        .where(Job.service << [service.id for service in services])
+    }
 
-    return ManagerAnswer(
+    return _answer(
         code=ReturnCodes.JOB_LIST,
         data={
             "services": [
                 {
-                    "docker_tasks": service.tasks(),
-                    "job": model_to_dict(Job.get_by_id(service.id)),
+                    "docker_tasks": tasks,
+                    "job": _job_to_dict(jobs[service.id]),
                 }
-                for service in services
+                for service, tasks in zip(services, services_tasks)
+                if service.id in jobs
             ]
         },
     )
@@ -370,42 +569,47 @@ def job_list(request_user: RequestUser):
 
 @app.post("/list_resources", response_model=ManagerAnswer)
 def list_resources(request_user: RequestUser, only_online: bool = Body(None), only_available: bool = Body(None)):
-    if (
-        permission_error := permission_check(request_user=request_user, required_level=PermissionLevel.USER)
-    ) is not None:
+    _, permission_error = permission_check(request_user=request_user, required_level=PermissionLevel.USER)
+    if permission_error is not None:
         return permission_error
 
-    workers: List[Node] = client.nodes.list(filters={"role": "worker"})
-
-    online_workers: List[str] = []
-    for node in workers:
-        # Force re-loading node information from Docker API
-        node.reload()
-        if node.attrs["Status"]["State"] == "ready" and node.attrs["Spec"]["Availability"] == "active":
-            online_workers.append(node.attrs["Description"]["Hostname"])
+    return _answer(code=ReturnCodes.RESOURCES, data=_available_resources())
 
-    all_services: Sequence[Service] = client.services.list(filters={"label": _SERVICE_LABEL_GPUS})
-    busy_gpus: Set[str] = {
-        gpu
-        for service in all_services
-        for gpu in service.attrs["Spec"]["Labels"][_SERVICE_LABEL_GPUS].split(_SERVICE_LABEL_GPU_SEP)
-    }
 
-    resources: Mapping[Worker, Sequence[GPU]] = GPU.by_workers(worker_ids=online_workers)
-    resources = {worker: [gpu for gpu in gpus if gpu.uuid not in busy_gpus] for worker, gpus in resources.items()}
+@app.post("/session_bootstrap", response_model=ManagerAnswer)
+def session_bootstrap(request_user: RequestUser):
+    # Everything the bot needs to start a new job, in a single round-trip: the resources are listed only if the user
+    # can actually dispatch a job
+    user, permission_error = permission_check(request_user=request_user, required_level=PermissionLevel.USER)
+    if permission_error is not None:
+        return permission_error
 
-    return ManagerAnswer(
-        code=ReturnCodes.RESOURCES,
-        data={
-            "workers": {worker.hostname: model_to_dict(worker) for worker in resources.keys()},
-            "gpus": {
-                worker.hostname: [model_to_dict(gpu, recurse=False) for gpu in gpus]
-                for worker, gpus in resources.items()
-            },
-        },
+    is_set: bool = user.public_ssh_key is not None
+    return _answer(
+        code=ReturnCodes.BOOTSTRAP,
+        data={"is_set": is_set, "resources": _available_resources() if is_set else None},
     )
 
 
+def _available_resources() -> Mapping[str, Any]:
+    online_workers: List[str] = _online_workers()
+
+    busy_gpus: Set[str] = _busy_gpus()
+
+    # The rows are read as plain dicts, with the same keys model_to_dict would produce, without building the models
+    gpus_data: Dict[str, List[Mapping[str, Any]]] = {}
+    for gpu in GPU.select().where(GPU.worker << online_workers).order_by(GPU.worker, GPU.index).dicts():
+        gpus_data.setdefault(gpu["worker"], [])
+        if gpu["uuid"] not in busy_gpus:
+            gpus_data[gpu["worker"]].append(gpu)
+
+    workers_data: Dict[str, Mapping[str, Any]] = {
+        worker["hostname"]: worker for worker in Worker.select().where(Worker.hostname << list(gpus_data)).dicts()
+    }
+
+    return {"workers": workers_data, "gpus": gpus_data}
+
+
 def run(service_port: int, service_host: str, owner_id: str, db_path: Path):
     beer_db.init(owner_id=owner_id, db_path=db_path)
 
@@ -1,11 +1,10 @@
 from typing import Any, Dict, List, Mapping, Optional, Sequence
 
-from pydantic import BaseModel
-
 from beers.nvidia import NvidiaGPU
+from beers.utils import ORJSONModel
 
 
-class WorkerModel(BaseModel):
+class WorkerModel(ORJSONModel):
     hostname: str
     external_ip: Optional[str]
 
@@ -17,7 +16,7 @@ class WorkerModel(BaseModel):
     info: Mapping[str, Any]
 
 
-class ResourcesModel(BaseModel):
+class ResourcesModel(ORJSONModel):
     cpu_limit: Optional[int]
     mem_limit: Optional[int]
     cpu_reservation: Optional[int]
@@ -25,7 +24,7 @@ class ResourcesModel(BaseModel):
     generic_resources: Dict | List[Dict]
 
 
-class JobRequestModel(BaseModel):
+class JobRequestModel(ORJSONModel):
     user_id: str
     image: str
     worker_hostname: str
@@ -35,7 +34,7 @@ class JobRequestModel(BaseModel):
     gpus: Sequence[Dict]
 
 
-class RequestUser(BaseModel):
+class RequestUser(ORJSONModel):
     user_id: str
     username: Optional[str]
     full_name: str
@@ -1,12 +1,22 @@
 # Partially borrowed from https://github.com/Avlyssna/gpu-info/blob/master/gpuinfo/nvidia.py
 # Standard library imports
+import csv
+import functools
+import logging
 import subprocess  # nosec
-from typing import Any, List, Mapping
+from typing import Any, Dict, List, Mapping, Sequence
 
-from pydantic import BaseModel
+from beers.utils import ORJSONModel
 
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
 
-class NvidiaGPU(BaseModel):
+pylogger = logging.getLogger(__name__)
+
+
+class NvidiaGPU(ORJSONModel):
     name: str
     uuid: str
     total_memory: int
@@ -14,44 +24,109 @@ class NvidiaGPU(BaseModel):
     info: Mapping[str, Any]
 
     # def get_memory_details(self):
-    #     row = query_nvsmi("memory.used,memory.free", self.index)[0]
+    #     row = query_nvsmi(("memory.used", "memory.free"), self.index)[0]
     #
     #     return {"used_memory": int(row[0]), "free_memory": int(row[1])}
 
 
-def query_nvsmi(properties: str, index=None):
-    query = ["nvidia-smi", f"--query-gpu={properties}", "--format=csv,noheader,nounits"]
+_GPU_PROPERTIES: Sequence[str] = (
+    "index",
+    "uuid",
+    "name",
+    "memory.total",
+    "clocks.gr",
+    "clocks.mem",
+    "clocks.max.gr",
+    "clocks.max.mem",
+)
+
+
+def query_nvsmi(properties: Sequence[str], index=None) -> List[List[str]]:
+    query = ["nvidia-smi", f"--query-gpu={','.join(properties)}", "--format=csv,noheader,nounits"]
 
     if index is not None:
         query.append(f"--id={index}")
 
-    process = subprocess.Popen(query, stdout=subprocess.PIPE, shell=False)  # nosec
-    output = process.stdout.read().decode(encoding="utf-8")
-    rows = [line.rstrip().split(", ") for line in output.splitlines()]
+    result = subprocess.run(query, capture_output=True, check=True, text=True, shell=False)  # nosec
 
-    return rows
+    return list(csv.reader(result.stdout.splitlines(), skipinitialspace=True))
 
 
-def get_gpus() -> List:
-    rows = query_nvsmi("index,uuid,name,memory.total")
+@functools.lru_cache(maxsize=1)
+def _nvml_init() -> bool:
+    # NVML is initialized once per process; without bindings or driver we fall back to nvidia-smi
+    if pynvml is None:
+        return False
+
+    try:
+        pynvml.nvmlInit()
+    except pynvml.NVMLError as e:
+        pylogger.warning("NVML not available, falling back to nvidia-smi: %s", e)
+        return False
+
+    return True
+
+
+def _get_gpus_nvml() -> List:
     gpus = []
 
-    for row in rows:
-        index, uuid, name, total_memory = row
-        index = int(index)
-        total_memory = int(total_memory)
+    for index in range(pynvml.nvmlDeviceGetCount()):
+        handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+        info = {
+            "core_clock_speed": pynvml.nvmlDeviceGetClockInfo(handle, pynvml.NVML_CLOCK_GRAPHICS),
+            "memory_clock_speed": pynvml.nvmlDeviceGetClockInfo(handle, pynvml.NVML_CLOCK_MEM),
+            "max_core_clock_speed": pynvml.nvmlDeviceGetMaxClockInfo(handle, pynvml.NVML_CLOCK_GRAPHICS),
+            "max_memory_clock_speed": pynvml.nvmlDeviceGetMaxClockInfo(handle, pynvml.NVML_CLOCK_MEM),
+        }
+
+        gpus.append(
+            NvidiaGPU(
+                index=index,
+                uuid=pynvml.nvmlDeviceGetUUID(handle),
+                name=pynvml.nvmlDeviceGetName(handle),
+                info=info,
+                # MiB, as reported by nvidia-smi
+                total_memory=pynvml.nvmlDeviceGetMemoryInfo(handle).total // 1024**2,
+            )
+        )
+
+    return gpus
+
 
-        def get_clock_speeds():
-            row = query_nvsmi("clocks.gr,clocks.mem", index)[0]
-            return {"core_clock_speed": int(row[0]), "memory_clock_speed": int(row[1])}
+def get_gpus() -> List:
+    if _nvml_init():
+        return _get_gpus_nvml()
 
-        def get_max_clock_speeds():
-            row = query_nvsmi("clocks.max.gr,clocks.max.mem", index)[0]
-            return {"max_core_clock_speed": int(row[0]), "max_memory_clock_speed": int(row[1])}
+    # A single nvidia-smi invocation for all the GPUs and all the properties
+    gpus = []
 
-        info = get_clock_speeds()
-        info.update(get_max_clock_speeds())
+    for row in query_nvsmi(_GPU_PROPERTIES):
+        index, uuid, name, total_memory, core_clock, memory_clock, max_core_clock, max_memory_clock = row
+        info = {
+            "core_clock_speed": int(core_clock),
+            "memory_clock_speed": int(memory_clock),
+            "max_core_clock_speed": int(max_core_clock),
+            "max_memory_clock_speed": int(max_memory_clock),
+        }
 
-        gpus.append(NvidiaGPU(index=index, uuid=uuid, name=name, info=info, total_memory=total_memory))
+        gpus.append(NvidiaGPU(index=int(index), uuid=uuid, name=name, info=info, total_memory=int(total_memory)))
 
     return gpus
+
+
+def get_clock_speeds() -> Dict[int, Dict[str, int]]:
+    # Only the current clock speeds, by GPU index: unlike the other properties, they change at runtime
+    if _nvml_init():
+        clock_speeds = {}
+        for index in range(pynvml.nvmlDeviceGetCount()):
+            handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+            clock_speeds[index] = {
+                "core_clock_speed": pynvml.nvmlDeviceGetClockInfo(handle, pynvml.NVML_CLOCK_GRAPHICS),
+                "memory_clock_speed": pynvml.nvmlDeviceGetClockInfo(handle, pynvml.NVML_CLOCK_MEM),
+            }
+        return clock_speeds
+
+    return {
+        int(index): {"core_clock_speed": int(core_clock), "memory_clock_speed": int(memory_clock)}
+        for index, core_clock, memory_clock in query_nvsmi(("index", "clocks.gr", "clocks.mem"))
+    }
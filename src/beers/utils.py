@@ -1,9 +1,12 @@
 from enum import Enum
 
-import uvicorn
+import orjson
+from pydantic import BaseModel
 
 
 def run_service(app, service_host: str, service_port: int):
+    import uvicorn
+
     uvicorn.run(app, host=service_host, port=service_port)
 
 
@@ -35,3 +38,15 @@ class StrEnum(str, Enum):
     def _generate_next_value_(self, start, count, last_values):
         """Return the lower-cased version of the member name."""
         return self.lower()
+
+
+def _orjson_dumps(v, *, default) -> str:
+    return orjson.dumps(v, default=default).decode()
+
+
+class ORJSONModel(BaseModel):
+    """BaseModel (de)serializing its JSON with orjson."""
+
+    class Config:
+        json_loads = orjson.loads
+        json_dumps = _orjson_dumps
@@ -1,9 +1,9 @@
+import functools
 import logging
 import platform
-import re
 import socket
 import uuid
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 import psutil
 
@@ -13,21 +13,41 @@ from beers.models import WorkerModel
 pylogger = logging.getLogger(__name__)
 
 
-def build_worker_specs(local_nfs_root: Optional[str]) -> WorkerModel:
+@functools.lru_cache(maxsize=1)
+def _static_gpus() -> Tuple[nvidia.NvidiaGPU, ...]:
+    # The uuid, name, total memory and max clock speeds of the GPUs do not change at runtime
+    return tuple(nvidia.get_gpus())
 
+
+def _get_gpus() -> List[nvidia.NvidiaGPU]:
+    clock_speeds: Dict[int, Dict[str, int]] = nvidia.get_clock_speeds()
+    return [gpu.copy(update={"info": {**gpu.info, **clock_speeds.get(gpu.index, {})}}) for gpu in _static_gpus()]
+
+
+@functools.lru_cache(maxsize=1)
+def _static_host_info() -> Dict[str, str]:
     # https://stackoverflow.com/a/58420504
+    return {
+        "platform": platform.system(),
+        "platform_release": platform.release(),
+        "platform_version": platform.version(),
+        "architecture": platform.machine(),
+        "hostname": socket.gethostname(),
+        "mac_address": uuid.getnode().to_bytes(6, "big").hex(":"),
+        "processor": platform.processor(),
+        "machine": platform.machine(),
+    }
+
+
+def build_worker_specs(local_nfs_root: Optional[str], refresh: bool = False) -> WorkerModel:
+    # The static GPU and host details are gathered only once, unless explicitly asked to: the current clock
+    # speeds and the IP address are read on every call
+    if refresh:
+        _static_gpus.cache_clear()
+        _static_host_info.cache_clear()
+
     try:
-        info = {
-            "platform": platform.system(),
-            "platform_release": platform.release(),
-            "platform_version": platform.version(),
-            "architecture": platform.machine(),
-            "hostname": socket.gethostname(),
-            "local_ip": socket.gethostbyname(socket.gethostname()),
-            "mac_address": ":".join(re.findall("..", "%012x" % uuid.getnode())),
-            "processor": platform.processor(),
-            "machine": platform.machine(),
-        }
+        info = {**_static_host_info(), "local_ip": socket.gethostbyname(socket.gethostname())}
 
         unit_measure = 1024.0**3
 
@@ -55,7 +75,7 @@ def build_worker_specs(local_nfs_root: Optional[str]) -> WorkerModel:
             local_nfs_root=local_nfs_root,
             # ram=ram,
             # disk=disk,
-            gpus=nvidia.get_gpus(),
+            gpus=_get_gpus(),
         )
     except Exception as e:
         pylogger.exception(e)
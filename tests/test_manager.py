@@ -0,0 +1,65 @@
+import importlib
+from unittest.mock import MagicMock
+
+import orjson
+import pytest
+
+pytest.importorskip("peewee")
+pytest.importorskip("fastapi")
+docker = pytest.importorskip("docker")
+
+from beers.manager import beer_db  # noqa: E402
+from beers.manager.api import PermissionLevel, ReturnCodes  # noqa: E402
+from beers.manager.beer_db import User  # noqa: E402
+from beers.models import RequestUser  # noqa: E402
+
+_OWNER_ID: str = "0"
+
+
+@pytest.fixture
+def service(monkeypatch, tmp_path):
+    # No Docker daemon is needed by the endpoints under test
+    monkeypatch.setattr(docker, "from_env", MagicMock)
+    service = importlib.import_module("beers.manager.service")
+    monkeypatch.setattr(service, "client", MagicMock())
+    service._USERS_CACHE.clear()
+    service._admin_usernames.cache_clear()
+
+    beer_db.init(owner_id=_OWNER_ID, db_path=tmp_path / "beers_db.sqlite")
+    User.update_details(user_id=_OWNER_ID, username="owner", full_name="Owner")
+    yield service
+    beer_db._db.close()
+
+
+def _owner() -> RequestUser:
+    return RequestUser(user_id=_OWNER_ID, username="owner", full_name="Owner")
+
+
+def _code(response) -> ReturnCodes:
+    return ReturnCodes(orjson.loads(response.body)["code"])
+
+
+def test_set_permission_keeps_user_details(service):
+    User.insert(id="1", username="user", full_name="User", public_ssh_key="ssh-ed25519 AAAA").execute()
+
+    response = service.set_permission(request_user=_owner(), user_id="1", permission_level=PermissionLevel.ADMIN)
+
+    assert _code(response) == ReturnCodes.REGISTRATION_SUCCESSFUL
+    user: User = User.get_by_id("1")
+    assert user.permission_level == PermissionLevel.ADMIN.value
+    assert (user.username, user.full_name, user.public_ssh_key) == ("user", "User", "ssh-ed25519 AAAA")
+
+
+def test_set_permission_not_registered(service):
+    response = service.set_permission(request_user=_owner(), user_id="1", permission_level=PermissionLevel.ADMIN)
+
+    assert _code(response) == ReturnCodes.NOT_REGISTERED_ERROR
+    assert User.get_or_none(User.id == "1") is None
+
+
+def test_register_user_once(service):
+    assert _code(service.register_user(request_user=_owner(), user_id="1")) == ReturnCodes.REGISTRATION_SUCCESSFUL
+    User.update_details(user_id="1", username="user", full_name="User")
+
+    assert _code(service.register_user(request_user=_owner(), user_id="1")) == ReturnCodes.ALREADY_REGISTERED_ERROR
+    assert User.get_by_id("1").username == "user"
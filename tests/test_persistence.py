@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+fakeredis = pytest.importorskip("fakeredis")
+
+from beers.bot.persistence import RedisPersistence  # noqa: E402
+
+
+@pytest.fixture
+def persistence():
+    persistence = RedisPersistence(redis_url="redis://localhost")
+    persistence.redis = fakeredis.FakeAsyncRedis()
+    return persistence
+
+
+def test_user_data_round_trip(persistence):
+    async def round_trip():
+        await persistence.update_user_data(user_id=1, data={"job": {"image": "pytorch", "gpu": 0}, 2: "non-str key"})
+        await persistence.update_user_data(user_id=42, data={})
+        return await persistence.get_user_data()
+
+    assert asyncio.run(round_trip()) == {1: {"job": {"image": "pytorch", "gpu": 0}, "2": "non-str key"}, 42: {}}
+
+
+def test_drop_user_data(persistence):
+    async def drop():
+        await persistence.update_user_data(user_id=1, data={"job": {}})
+        await persistence.drop_user_data(user_id=1)
+        return await persistence.get_user_data()
+
+    assert asyncio.run(drop()) == {}
+
+
+def test_conversations_round_trip(persistence):
+    async def round_trip():
+        await persistence.update_conversation(name="job", key=(1, 2), new_state=3)
+        await persistence.update_conversation(name="job", key=(-4, 5), new_state=0)
+        await persistence.update_conversation(name="other", key=(1, 2), new_state=7)
+        return await persistence.get_conversations(name="job"), await persistence.get_conversations(name="other")
+
+    assert asyncio.run(round_trip()) == ({(1, 2): 3, (-4, 5): 0}, {(1, 2): 7})
+
+
+def test_conversation_end_deletes_state(persistence):
+    async def end():
+        await persistence.update_conversation(name="job", key=(1, 2), new_state=3)
+        await persistence.update_conversation(name="job", key=(1, 2), new_state=None)
+        return await persistence.get_conversations(name="job")
+
+    assert asyncio.run(end()) == {}
+
+
+def test_entries_expire(persistence):
+    async def ttls():
+        await persistence.update_user_data(user_id=1, data={})
+        await persistence.update_conversation(name="job", key=(1, 2), new_state=3)
+        return await persistence.redis.ttl("beers:session:user_data:1"), await persistence.redis.ttl(
+            "beers:session:conversation:job:1:2"
+        )
+
+    assert all(0 < ttl <= persistence.ttl for ttl in asyncio.run(ttls()))
+
+
+def test_flush_closes_the_connection(persistence):
+    asyncio.run(persistence.flush())